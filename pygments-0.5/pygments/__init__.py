@@ -29,7 +29,7 @@ __license__ = 'GNU Lesser General Public License (LGPL)'
 __author__ = 'Georg Brandl <g.brandl@gmx.net>'
 __url__ = 'http://pygments.pocoo.org/'
 
-__all__ = ['lex', 'format', 'highlight']
+__all__ = ['lex', 'format', 'highlight', 'highlight_stream']
 
 
 import sys, os
@@ -37,17 +37,36 @@ import sys, os
 from StringIO import StringIO
 
 from pygments.util import OptionError
+from pygments.filter import apply_filters, coalesce_tokens
 from pygments.lexers import LEXERS, get_lexer_by_name, get_lexer_for_filename
 
-from pygments.formatters import FORMATTERS, get_formatter_by_name, \
-     get_formatter_for_filename, TerminalFormatter
+from pygments.formatters import get_formatter_by_name, \
+     get_formatter_for_filename
 
 
-def lex(code, lexer):
+def lex(code, lexer, cache=None, filters=None):
     """
     Lex ``code`` with ``lexer`` and return an iterable of tokens.
+
+    If ``cache`` is given, it must be a `pygments.cache.TokenCache`
+    that is used to look up and store the token stream.
+
+    Adjacent tokens of the same type are merged, then the stream is
+    passed through the `pygments.filter.Filter` instances in
+    ``filters``, if given.
     """
-    return lexer.get_tokens(code)
+    if cache is not None:
+        tokens = cache.get_tokens(code, lexer)
+    else:
+        tokens = lexer.get_tokens(code)
+    return _filter(tokens, lexer, filters)
+
+
+def _filter(tokens, lexer, filters):
+    tokens = coalesce_tokens(tokens)
+    if filters:
+        tokens = apply_filters(tokens, filters, lexer)
+    return tokens
 
 
 def format(tokens, formatter, outfile=None):
@@ -64,7 +83,8 @@ def format(tokens, formatter, outfile=None):
         return realoutfile.getvalue()
 
 
-def highlight(code, lexer, formatter, outfile=None):
+def highlight(code, lexer, formatter, outfile=None, cache=None,
+              filters=None):
     """
     Lex ``code`` with ``lexer`` and format it with the formatter
     ``formatter``.
@@ -72,8 +92,223 @@ def highlight(code, lexer, formatter, outfile=None):
     If ``outfile`` is given and a valid file object (an object
     with a ``write`` method), the result will be written to it, otherwise
     it is returned as a string.
+
+    ``cache`` and ``filters`` are passed to `lex`.
+    """
+    return format(lex(code, lexer, cache, filters), formatter, outfile)
+
+
+def highlight_stream(infile, lexer, formatter, outfile=None,
+                     chunksize=65536, filters=None):
+    """
+    Like `highlight`, but read the code from the file object ``infile``.
+
+    Lexers that support it lex the code in chunks of ``chunksize``
+    characters, and the formatter gets the tokens of every chunk before
+    the next one is read. Tokens longer than ``chunksize`` may be lexed
+    differently than by `highlight`.
+    """
+    tokens = lexer.get_tokens_stream(infile, chunksize)
+    return format(_filter(tokens, lexer, filters), formatter, outfile)
+
+
+def _mmap_file(f):
+    """
+    Return a read-only memory map of the file object ``f``, or its
+    contents if it can't be mapped (e.g. because it is empty).
+    """
+    import mmap
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return f.read()
+
+
+#: Extensions of the output files and the shared stylesheet written in
+#: batch mode, by formatter class name. Other formatters write ``.txt``
+#: files.
+_batch_extensions = {
+    'HtmlFormatter':        ('.html', '.css'),
+    'LatexFormatter':       ('.tex', '.tex'),
+    'RawTokenFormatter':    ('.raw', '.txt'),
+    'BinaryTokenFormatter': ('.btok', '.txt'),
+}
+
+#: Formatter used by the current batch mode process, see `_batch_init`
+_batch_formatter = None
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def _iter_batch_files(paths, outdir):
+    """
+    Yield ``(filename, output name, explicit)`` for the files in
+    ``paths`` and, in sorted order, the files below the directories in
+    ``paths``. The output name is relative to the output directory
+    ``outdir``, which is not descended into.
     """
-    return format(lex(code, lexer), formatter, outfile)
+    outdir = os.path.abspath(outdir)
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path, os.path.basename(path), True
+            continue
+        root = os.path.normpath(path)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [dn for dn in dirnames if os.path.abspath(
+                os.path.join(dirpath, dn)) != outdir]
+            dirnames.sort()
+            filenames.sort()
+            for fn in filenames:
+                fn = os.path.join(dirpath, fn)
+                yield fn, fn[len(root):].lstrip(os.sep), False
+
+
+def _batch_init(formattercls, options):
+    global _batch_formatter
+    _batch_formatter = formattercls(**options)
+
+
+def _batch_highlight(job):
+    """
+    Highlight one file in batch mode. Return an error message, or None
+    if the file was highlighted.
+    """
+    infn, outfn, lexercls, options = job
+    try:
+        infile = file(infn, 'rb')
+        try:
+            code = infile.read()
+        finally:
+            infile.close()
+        outfile = file(outfn, 'wb')
+        try:
+            highlight(code, lexercls(**options), _batch_formatter, outfile)
+        finally:
+            outfile.close()
+    except Exception, err:
+        return '%s: %s' % (infn, err)
+    return None
+
+
+def _highlight_batch(jobs, formatter, options, processes):
+    """
+    Highlight the files of ``jobs``, a list of ``(infile name, outfile
+    name, lexer class)`` triples, with ``processes`` worker processes if
+    the `multiprocessing` module is available. Errors are printed in the
+    order of ``jobs``; return their number.
+    """
+    jobs = [job + (options,) for job in jobs]
+    initargs = (formatter.__class__, options)
+    pool = None
+    if processes > 1 and len(jobs) > 1:
+        try:
+            import multiprocessing
+        except ImportError:
+            pass
+        else:
+            pool = multiprocessing.Pool(min(processes, len(jobs)),
+                                        _batch_init, initargs)
+    if pool is None:
+        from itertools import imap
+        _batch_init(*initargs)
+        results = imap(_batch_highlight, jobs)
+    else:
+        results = pool.imap(_batch_highlight, jobs)
+
+    errors = 0
+    try:
+        for err in results:
+            if err is not None:
+                print >>sys.stderr, 'Error:', err
+                errors += 1
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return errors
+
+
+#: Formatters whose style definitions ``-S all -d <outdir>`` exports
+_export_formatters = ('html', 'latex')
+
+
+def _export_styles(outdir, fmternames, arg, options):
+    """
+    Write the style definitions of every builtin style for each of the
+    formatters named in ``fmternames`` to a file in ``outdir``, named
+    after the style and a hash of the content, so that the files can be
+    cached forever. The file ``index.txt`` in ``outdir`` lists them as
+    ``style<TAB>formatter<TAB>file name`` lines, together with the files
+    of other formatters that earlier calls wrote; return its lines.
+    Raise ValueError for formatters that have no style definitions.
+    """
+    try:
+        from hashlib import sha1 as sha
+    except ImportError:
+        import sha
+        sha = sha.new
+    from pygments.formatter import Formatter
+    from pygments.styles import STYLE_MAP
+
+    for fmtername in fmternames:
+        fmtercls = get_formatter_by_name(fmtername, **options).__class__
+        if fmtercls.get_style_defs.im_func is \
+           Formatter.get_style_defs.im_func:
+            raise ValueError('the %s formatter has no style definitions'
+                             % fmtername)
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    indexfn = os.path.join(outdir, 'index.txt')
+    # maps (style, formatter) to the file name
+    index = {}
+    if os.path.isfile(indexfn):
+        f = file(indexfn)
+        try:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) == 3:
+                    index[fields[0], fields[1]] = fields[2]
+        finally:
+            f.close()
+    stylenames = STYLE_MAP.keys()
+    stylenames.sort()
+    for fmtername in fmternames:
+        for stylename in stylenames:
+            fmter_options = dict(options)
+            fmter_options['style'] = stylename
+            fmter = get_formatter_by_name(fmtername, **fmter_options)
+            defs = fmter.get_style_defs(arg)
+            if isinstance(defs, unicode):
+                defs = defs.encode('utf-8')
+            styleext = _batch_extensions.get(fmter.__class__.__name__,
+                                             ('.txt', '.txt'))[1]
+            fn = '%s.%s%s' % (stylename, sha(defs).hexdigest()[:12],
+                              styleext)
+            f = file(os.path.join(outdir, fn), 'wb')
+            try:
+                f.write(defs)
+            finally:
+                f.close()
+            index[stylename, fmtername] = fn
+    keys = index.keys()
+    keys.sort()
+    lines = ['%s\t%s\t%s' % (key + (index[key],)) for key in keys]
+    f = file(indexfn, 'w')
+    try:
+        f.write(''.join([line + '\n' for line in lines]))
+    finally:
+        f.close()
+    return lines
 
 
 def cmdline_main(args):
@@ -83,8 +318,13 @@ def cmdline_main(args):
     import getopt
 
     USAGE = """\
-Usage: %s [-l <lexer>] [-f <formatter>] [-O <options>] [-o <outfile>] [<infile>]
+Usage: %s [-l <lexer>] [-f <formatter>] [-O <options>] [-s | -m]
+          [-o <outfile>] [<infile>]
+       %s -d <outdir> [-j <jobs>] [-l <lexer>] [-f <formatter>]
+          [-a <arg>] [-O <options>] <infile or directory> ...
        %s -S <style> -f <formatter> [-a <arg>] [-O <options>]
+       %s -S all -d <outdir> [-f <formatter>] [-a <arg>] [-O <options>]
+       %s -p [-l <lexer>] [-O <options>] [-o <outfile>] [<infile>]
        %s -L | -h | -V
 
 Highlight the input file and write the result to <outfile>.
@@ -102,17 +342,36 @@ the terminal formatter will be used by default.
 With the -O option, you can give the lexer and formatter a comma-
 separated list of options, e.g. ``-O bg=light,python=cool``.
 
+With the -s option, the input is read and highlighted in chunks, so that
+large files needn't fit in memory. With the -m option, the input file is
+memory mapped instead of read, and lexed in place if possible.
+
+With the -d option, all input files and the files below the input
+directories are highlighted into files of the same relative name in
+<outdir>, together with a stylesheet "style" with the style definitions
+(-a is passed to them like with -S). Files in directories that have no
+lexer are skipped. The default formatter is HTML; -j gives the number of
+worker processes and defaults to the number of CPUs.
+
 With the -S option, print out style definitions for style <style>
 for formatter <formatter>. The argument given by -a is formatter
-dependent.
+dependent. "-S all -d <outdir>" writes the definitions of all builtin
+styles for the HTML and LaTeX formatters, or for <formatter>, to files
+in <outdir> whose names contain a hash of their content, and lists them
+in <outdir>/index.txt.
+
+With the -p option, the input is lexed with profiling of the lexer's
+rules instead of highlighted, and a report of the rules that take the
+most time and of those that are tried most but rarely match is written.
+This works for lexers based on regular expressions.
 
 The -L option lists all available lexers and formatters.
 The -h option prints this help.
 The -V option prints the package version.
-""" % ((args[0],)*3)
+""" % ((args[0],)*6)
 
     try:
-        opts, args = getopt.getopt(args[1:], "l:f:o:O:LhVS:a:")
+        opts, args = getopt.getopt(args[1:], "l:f:o:O:LhVS:a:smd:j:p")
     except getopt.GetoptError:
         print >>sys.stderr, USAGE
         return 2
@@ -144,7 +403,7 @@ The -V option prints the package version.
 
         info = []
         maxlen = 0
-        for _, fullname, names, exts in LEXERS.itervalues():
+        for _, fullname, names, exts, _ in LEXERS.itervalues():
             tup = (', '.join(names)+':', fullname,
                    exts and '(extensions ' + ', '.join(exts) + ')' or '')
             info.append(tup)
@@ -157,6 +416,8 @@ The -V option prints the package version.
         print "Formatters:"
         print "~~~~~~~~~~~"
 
+        # this imports all formatters
+        from pygments.formatters import FORMATTERS
         info = []
         maxlen = 0
         for fullname, names, exts, doc in FORMATTERS.itervalues():
@@ -185,6 +446,18 @@ The -V option prints the package version.
     a_opt = opts.pop('-a', None)
     if S_opt is not None:
         f_opt = opts.pop('-f', None)
+        d_opt = opts.pop('-d', None)
+        if d_opt is not None:
+            if S_opt != 'all' or opts or args:
+                print >>sys.stderr, USAGE
+                return 2
+            try:
+                _export_styles(d_opt, f_opt and [f_opt] or
+                               _export_formatters, a_opt or '', O_opts)
+            except (OptionError, ValueError, EnvironmentError), err:
+                print >>sys.stderr, 'Error:', err
+                return 1
+            return 0
         if not f_opt:
             print >>sys.stderr, USAGE
             return 2
@@ -203,7 +476,75 @@ The -V option prints the package version.
         print fmter.get_style_defs(arg)
         return 0
 
-    if a_opt is not None:
+    d_opt = opts.pop('-d', None)
+    if d_opt is not None:
+        if not args or '-o' in opts or '-s' in opts or '-m' in opts:
+            print >>sys.stderr, USAGE
+            return 2
+        try:
+            processes = int(opts.pop('-j', None) or _cpu_count())
+        except ValueError:
+            print >>sys.stderr, USAGE
+            return 2
+
+        try:
+            fmter = get_formatter_by_name(opts.pop('-f', 'html'), **O_opts)
+            lexer = opts.pop('-l', None)
+            if lexer:
+                lexer = get_lexer_by_name(lexer, **O_opts).__class__
+        except (OptionError, ValueError), err:
+            print >>sys.stderr, 'Error:', err
+            return 1
+        ext, styleext = _batch_extensions.get(fmter.__class__.__name__,
+                                              ('.txt', '.txt'))
+
+        errors = 0
+        jobs = []
+        outnames = {}
+        for infn, outname, explicit in _iter_batch_files(args, d_opt):
+            lexercls = lexer
+            if not lexercls:
+                try:
+                    lexercls = get_lexer_for_filename(infn).__class__
+                except ValueError, err:
+                    if explicit:
+                        print >>sys.stderr, 'Error:', err
+                        errors += 1
+                    continue
+            outfn = os.path.join(d_opt, outname + ext)
+            if outfn in outnames:
+                print >>sys.stderr, 'Error: %s: same output file as %s' % \
+                      (infn, outnames[outfn])
+                errors += 1
+                continue
+            outnames[outfn] = infn
+            jobs.append((infn, outfn, lexercls))
+
+        try:
+            for dirname in [d_opt] + [os.path.dirname(outfn) for
+                                      _, outfn, _ in jobs]:
+                if not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+            styledefs = fmter.get_style_defs(a_opt or '')
+            if styledefs:
+                stylefile = file(os.path.join(d_opt, 'style' + styleext), 'w')
+                try:
+                    stylefile.write(styledefs + '\n')
+                finally:
+                    stylefile.close()
+        except EnvironmentError, err:
+            print >>sys.stderr, 'Error: cannot write to outdir:', err
+            return 1
+
+        errors += _highlight_batch(jobs, fmter, O_opts, processes)
+        return errors and 1 or 0
+
+    if a_opt is not None or '-j' in opts:
+        print >>sys.stderr, USAGE
+        return 2
+
+    profile = opts.pop('-p', None) is not None
+    if profile and ('-f' in opts or '-s' in opts or '-m' in opts):
         print >>sys.stderr, USAGE
         return 2
 
@@ -217,7 +558,7 @@ The -V option prints the package version.
             return 1
 
     if outfn:
-        if not fmter:
+        if not fmter and not profile:
             try:
                 fmter = get_formatter_for_filename(outfn, **O_opts)
             except (OptionError, ValueError), err:
@@ -230,7 +571,7 @@ The -V option prints the package version.
             return 1
     else:
         if not fmter:
-            fmter = TerminalFormatter(**O_opts)
+            fmter = get_formatter_by_name('terminal', **O_opts)
         outfile = sys.stdout
 
     lexer = opts.pop('-l', None)
@@ -241,6 +582,12 @@ The -V option prints the package version.
             print >>sys.stderr, 'Error:', err
             return 1
 
+    stream = opts.pop('-s', None) is not None
+    use_mmap = opts.pop('-m', None) is not None
+    if use_mmap and (stream or not args):
+        print >>sys.stderr, USAGE
+        return 2
+
     if args:
         infn = args[0]
         if not lexer:
@@ -251,7 +598,11 @@ The -V option prints the package version.
                 return 1
 
         try:
-            code = file(infn).read()
+            infile = file(infn, 'rb')
+            if use_mmap:
+                code = _mmap_file(infile)
+            elif not stream:
+                code = infile.read()
         except Exception, err:
             print >>sys.stderr, 'Error: cannot read infile:', err
             return 1
@@ -259,10 +610,25 @@ The -V option prints the package version.
         if not lexer:
             print >>sys.stderr, 'Error: no lexer name given and reading from stdin'
             return 2
-        code = sys.stdin.read()
+        infile = sys.stdin
+        if not stream:
+            code = infile.read()
+
+    if profile:
+        from pygments.lexer import RegexLexer
+        from pygments.profiling import profile_lexer
+        if not isinstance(lexer, RegexLexer):
+            print >>sys.stderr, 'Error: cannot profile %s, it is not ' \
+                  'based on regular expressions' % lexer.__class__.__name__
+            return 1
+        outfile.write(profile_lexer(lexer, code).format_report())
+        return 0
 
     try:
-        highlight(code, lexer, fmter, outfile)
+        if stream:
+            highlight_stream(infile, lexer, fmter, outfile)
+        else:
+            highlight(code, lexer, fmter, outfile)
     except Exception, err:
         print >>sys.stderr, 'Error while highlighting:', err
         return 1
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+    pygments.binarytokens
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Constants of the binary token stream format that the
+    `BinaryTokenFormatter` writes and the `BinaryTokenLexer` reads.
+
+    :copyright: 2006 by Georg Brandl.
+    :license: GNU LGPL, see LICENSE for more details.
+"""
+
+#: Start of a binary token stream, followed by one byte that names the
+#: compression of the rest of the stream (see `BINARY_COMPRESSIONS`).
+BINARY_MAGIC = 'PYGTOK\x01'
+
+#: Compression option values and their header bytes
+BINARY_COMPRESSIONS = {'': '\0', 'zlib': 'z', 'bz2': 'b'}
+
+#: Header of a block: kind of the values (see below), number of new token
+#: types, length of their names, number of tokens, length of the token
+#: data in bytes
+BINARY_BLOCK_HEADER = '<BHIII'
+
+#: Kinds of the values of a block. The values of a `BLOCK_MIXED` block
+#: are byte strings and unicode strings that can't be joined; a byte per
+#: token that is 1 for unicode values follows the value lengths, which
+#: are those of the encoded values.
+BLOCK_STR = 0
+BLOCK_UNICODE = 1
+BLOCK_MIXED = 2
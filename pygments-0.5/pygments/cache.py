@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+    pygments.cache
+    ~~~~~~~~~~~~~~
+
+    Cache for lexed token streams.
+
+    :copyright: 2006 by Georg Brandl.
+    :license: GNU LGPL, see LICENSE for more details.
+"""
+import os
+try:
+    from hashlib import sha1 as sha
+except ImportError:
+    import sha
+    sha = sha.new
+
+from pygments import __version__
+from pygments.lexers.special import RawTokenLexer
+from pygments.formatters.other import RawTokenFormatter
+from pygments.tokenbuffer import TokenBuffer
+
+
+__all__ = ['TokenCache']
+
+
+def get_cache_key(code, lexer):
+    """
+    Return the cache key for lexing ``code`` with ``lexer``: a SHA1
+    hex digest over the Pygments version, the lexer class, its options
+    and the text. The version is included because the rules of the
+    lexers change between releases.
+    """
+    cls = lexer.__class__
+    options = lexer.options.items()
+    options.sort()
+    if isinstance(code, unicode):
+        code = code.encode('utf-8')
+    digest = sha('%s\0%s.%s' % (__version__, cls.__module__, cls.__name__))
+    digest.update('\0' + repr(options) + '\0')
+    digest.update(code)
+    return digest.hexdigest()
+
+
+class TokenCache(object):
+    """
+    Keeps the token streams of recently lexed texts so that lexing the
+    same text with the same lexer again doesn't run the lexer.
+
+    ``maxsize`` is the approximate memory limit for cached streams in
+    bytes; the least recently used streams are evicted first.
+
+    The streams are kept as `TokenBuffer` objects.
+
+    If ``cachedir`` is given, streams are also stored there in the
+    `RawTokenFormatter` format and replayed with the `RawTokenLexer`
+    when they are not in memory.
+    """
+
+    def __init__(self, maxsize=4*1024*1024, cachedir=None):
+        self.maxsize = maxsize
+        self.cachedir = cachedir
+        self.size = 0
+        self._entries = {}      # key -> [tick, size, tokens]
+        self._queue = []        # (tick, key) in order of use
+        self._head = 0          # index of the oldest item in _queue
+        self._tick = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Forget all streams kept in memory."""
+        self._entries.clear()
+        self._queue = []
+        self._head = 0
+        self.size = 0
+
+    def get_tokens(self, code, lexer):
+        """
+        Return the token stream for ``code`` lexed with ``lexer`` as a
+        `TokenBuffer`.
+        """
+        key = get_cache_key(code, lexer)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._touch(key, entry)
+            return entry[2]
+        tokens = self._load(key)
+        if tokens is None:
+            tokens = TokenBuffer(lexer.get_tokens(code))
+            self._store(key, tokens)
+        self._add(key, tokens)
+        return tokens
+
+    def _touch(self, key, entry):
+        self._tick += 1
+        entry[0] = self._tick
+        self._queue.append((self._tick, key))
+        if len(self._queue) > 2 * len(self._entries) + 32:
+            # drop the stale queue items left behind by cache hits and
+            # the items already taken off the queue by evictions
+            items = [(entry[0], key) for key, entry in
+                     self._entries.iteritems()]
+            items.sort()
+            self._queue = items
+            self._head = 0
+
+    def _add(self, key, tokens):
+        size = tokens.get_size()
+        if size > self.maxsize:
+            return
+        entry = [0, size, tokens]
+        self._entries[key] = entry
+        self._touch(key, entry)
+        self.size += size
+        entries = self._entries
+        queue = self._queue
+        while self.size > self.maxsize:
+            tick, key = queue[self._head]
+            self._head += 1
+            entry = entries.get(key)
+            # skip queue items made stale by a later use
+            if entry is not None and entry[0] == tick:
+                del entries[key]
+                self.size -= entry[1]
+
+    def _get_filename(self, key):
+        return os.path.join(self.cachedir, key + '.raw')
+
+    def _load(self, key):
+        if not self.cachedir:
+            return None
+        try:
+            f = file(self._get_filename(key), 'rb')
+        except IOError:
+            return None
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        return TokenBuffer([(ttype, value) for index, ttype, value in
+                            RawTokenLexer().get_tokens_unprocessed(data)])
+
+    def _store(self, key, tokens):
+        if not self.cachedir or not tokens:
+            return
+        filename = self._get_filename(key)
+        tmpname = '%s.%d.tmp' % (filename, os.getpid())
+        try:
+            f = file(tmpname, 'wb')
+            try:
+                RawTokenFormatter().format(tokens, f)
+            finally:
+                f.close()
+            if os.path.exists(filename):
+                # another process was faster, on Windows rename would fail
+                os.remove(tmpname)
+            else:
+                os.rename(tmpname, filename)
+        except (IOError, OSError):
+            # the disk tier is only an optimization
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
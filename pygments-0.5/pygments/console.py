@@ -58,6 +58,15 @@ def ansiformat(attr, text):
         _color_     underlined color
         +color+     blinking color
     """
+    prefix, suffix = ansi_escapes(attr)
+    return prefix + text + suffix
+
+
+def ansi_escapes(attr):
+    """
+    Return the ``(prefix, suffix)`` escape sequences that `ansiformat`
+    puts around the text for ``attr``.
+    """
     result = []
     if attr[:1] == attr[-1:] == '+':
         result.append(codes['blink'])
@@ -69,6 +78,4 @@ def ansiformat(attr, text):
         result.append(codes['underline'])
         attr = attr[1:-1]
     result.append(codes[attr])
-    result.append(text)
-    result.append(codes['reset'])
-    return ''.join(result)
+    return ''.join(result), codes['reset']
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+    pygments.filter
+    ~~~~~~~~~~~~~~~
+
+    Token stream filters, applied between lexer and formatter.
+
+    :copyright: 2006 by Georg Brandl.
+    :license: GNU LGPL, see LICENSE for more details.
+"""
+
+__all__ = ['Filter', 'apply_filters', 'coalesce_tokens']
+
+
+#: Runs of tokens are only merged up to about this many characters, so
+#: that streamed texts aren't held in memory as a whole
+MAX_COALESCED_SIZE = 8192
+
+
+def coalesce_tokens(tokens):
+    """
+    Merge runs of adjacent tokens of the same type in the iterable
+    ``tokens`` into one token, and drop tokens with empty values. A run
+    is split after the token that makes it longer than
+    `MAX_COALESCED_SIZE` characters.
+    """
+    lasttype = None
+    values = []
+    size = 0
+    for ttype, value in tokens:
+        if not value:
+            continue
+        if ttype is lasttype:
+            values.append(value)
+            size += len(value)
+            if size > MAX_COALESCED_SIZE:
+                yield lasttype, ''.join(values)
+                values = []
+                size = 0
+        else:
+            if values:
+                yield lasttype, ''.join(values)
+            lasttype = ttype
+            values = [value]
+            size = len(value)
+    if values:
+        yield lasttype, ''.join(values)
+
+
+def apply_filters(stream, filters, lexer=None):
+    """
+    Return the token stream ``stream`` passed through the `Filter`
+    instances in ``filters``, in order. ``lexer`` is the lexer that
+    produced the stream, if known.
+    """
+    for filter_ in filters:
+        stream = filter_.filter(lexer, stream)
+    return stream
+
+
+class Filter(object):
+    """
+    Transforms a token stream.
+
+    Subclasses override `filter`; the options given to the constructor
+    are available as the ``options`` attribute.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    def filter(self, lexer, stream):
+        """
+        Return an iterable of ``(tokentype, value)`` tuples for the
+        token stream ``stream`` that ``lexer`` produced. ``lexer`` can
+        be None.
+        """
+        raise NotImplementedError()
@@ -30,7 +30,7 @@ class Formatter(object):
     ``style``
         The style to use, can be a string or a Style subclass
         (default: "default"). Not used by e.g. the
-        TerminalFormatter.
+        TerminalFormatter in 16-color mode.
     ``full``
         Tells the formatter to output a "full" document, i.e.
         a complete self-contained document. This doesn't have
@@ -46,6 +46,22 @@ class Formatter(object):
         self.title = options.get('title', '')
         self.options = options
 
+    def _get_style_tables(self, key, create):
+        """
+        Return the tables that ``create()`` builds from the style. They
+        are built once per style, formatter class and ``key``, a tuple of
+        the option values that the tables depend on, and are shared by
+        all formatters with the same values, so they must not be changed
+        afterwards (except for caches that only grow).
+        """
+        cache = self.style._formatter_cache
+        key = (self.__class__,) + key
+        try:
+            return cache[key]
+        except KeyError:
+            tables = cache[key] = create()
+            return tables
+
     def get_style_defs(self, arg=''):
         """
         Return the style definitions for the current style as a string.
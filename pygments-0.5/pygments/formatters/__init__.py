@@ -9,12 +9,31 @@
     :license: GNU LGPL, see LICENSE for more details.
 """
 import os.path
-from pygments.formatters.html import HtmlFormatter
-from pygments.formatters.terminal import TerminalFormatter
-from pygments.formatters.latex import LatexFormatter
-from pygments.formatters.bbcode import BBCodeFormatter
-from pygments.formatters.other import NullFormatter, RawTokenFormatter
-from pygments.plugin import find_plugin_formatters
+import types
+from pygments.plugin import find_plugin_formatters, register_clear_hook
+
+
+#: Map formatter class names to ``(module, longname, names, file
+#: extensions)``. The modules are only imported when a formatter is used.
+FORMATTER_MAP = {
+    'HtmlFormatter':      ('pygments.formatters.html', 'HTML',
+                           ('html',), ('.htm', '.html')),
+    'TerminalFormatter':  ('pygments.formatters.terminal', 'Terminal',
+                           ('terminal', 'console'), ()),
+    'LatexFormatter':     ('pygments.formatters.latex', 'LaTeX',
+                           ('latex', 'tex'), ('.tex',)),
+    'RawTokenFormatter':  ('pygments.formatters.other', 'Raw tokens',
+                           ('raw', 'tokens'), ('.raw',)),
+    'BinaryTokenFormatter': ('pygments.formatters.other', 'Binary tokens',
+                           ('bintokens',), ('.btok',)),
+    'NullFormatter':      ('pygments.formatters.other', 'Text only',
+                           ('text', 'null'), ('.txt',)),
+    'BBCodeFormatter':    ('pygments.formatters.bbcode', 'BBcode',
+                           ('bbcode', 'bb'), ())
+}
+
+__all__ = ['get_formatter_by_name', 'get_formatter_for_filename'] + \
+          FORMATTER_MAP.keys()
 
 
 def _doc_desc(obj):
@@ -27,53 +46,89 @@ def _doc_desc(obj):
     return res
 
 
-#: Map formatter classes to ``(longname, names, file extensions, descr)``.
-FORMATTERS = {
-    HtmlFormatter:        ('HTML', ('html',), ('.htm', '.html'),
-                           _doc_desc(HtmlFormatter)),
-    TerminalFormatter:    ('Terminal', ('terminal', 'console'), (),
-                           _doc_desc(TerminalFormatter)),
-    LatexFormatter:       ('LaTeX', ('latex', 'tex'), ('.tex',),
-                           _doc_desc(LatexFormatter)),
-    RawTokenFormatter:    ('Raw tokens', ('raw', 'tokens'), ('.raw',),
-                           _doc_desc(RawTokenFormatter)),
-    NullFormatter:        ('Text only', ('text', 'null'), ('.txt',),
-                           _doc_desc(NullFormatter)),
-    BBCodeFormatter:      ('BBcode', ('bbcode', 'bb'), (),
-                           _doc_desc(BBCodeFormatter))
-}
+def _load_formatter(name):
+    """Return the builtin formatter class called ``name``."""
+    mod = __import__(FORMATTER_MAP[name][0], None, None, [name])
+    return getattr(mod, name)
 
 
+def _get_formatters():
+    """
+    Return a dict mapping formatter classes to ``(longname, names,
+    file extensions, descr)``. This imports all builtin formatters.
+    """
+    result = {}
+    for name, (_, longname, names, exts) in FORMATTER_MAP.iteritems():
+        cls = _load_formatter(name)
+        result[cls] = (longname, names, exts, _doc_desc(cls))
+    return result
+
+
+#: Maps names and ``"/" + extension`` to builtin formatter class names.
 _formatter_cache = {}
+#: The same for plugin formatters, which are only looked up if no builtin
+#: formatter matches.
+_plugin_formatter_cache = {}
+register_clear_hook(_plugin_formatter_cache.clear)
 
 def _init_formatter_cache():
     if _formatter_cache:
         return
-    for cls, info in FORMATTERS.iteritems():
-        for alias in info[1]:
+    for cls, info in FORMATTER_MAP.iteritems():
+        for alias in info[2]:
             _formatter_cache[alias] = cls
-        for ext in info[2]:
+        for ext in info[3]:
             _formatter_cache["/"+ext] = cls
-    for name, cls in find_plugin_formatters():
-        _formatter_cache[name] = cls
 
 
-def get_formatter_by_name(name, **options):
+def _find_formatter(key):
     _init_formatter_cache()
-    cls = _formatter_cache.get(name, None)
+    cls = _formatter_cache.get(key)
+    if cls:
+        return _load_formatter(cls)
+    if not _plugin_formatter_cache:
+        for name, cls in find_plugin_formatters():
+            _plugin_formatter_cache[name] = cls
+    return _plugin_formatter_cache.get(key)
+
+
+def get_formatter_by_name(name, **options):
+    cls = _find_formatter(name)
     if not cls:
         raise ValueError("No formatter found for name %r" % name)
     return cls(**options)
 
 
 def get_formatter_for_filename(fn, **options):
-    _init_formatter_cache()
     # try by filename extension
-    cls = _formatter_cache.get("/"+os.path.splitext(fn)[1], None)
+    cls = _find_formatter("/"+os.path.splitext(fn)[1])
     if cls:
         return cls(**options)
     # try by whole file name
-    cls = _formatter_cache.get("/"+os.path.basename(fn), None)
+    cls = _find_formatter("/"+os.path.basename(fn))
     if not cls:
         raise ValueError("No formatter found for file name %r" % fn)
     return cls(**options)
+
+
+class _automodule(types.ModuleType):
+    """Automatically import formatters."""
+
+    def __getattr__(self, name):
+        if name in FORMATTER_MAP:
+            cls = _load_formatter(name)
+            setattr(self, name, cls)
+            return cls
+        if name == 'FORMATTERS':
+            formatters = _get_formatters()
+            setattr(self, name, formatters)
+            return formatters
+        raise AttributeError(name)
+
+
+import sys
+oldmod = sys.modules['pygments.formatters']
+newmod = _automodule('pygments.formatters')
+newmod.__dict__.update(oldmod.__dict__)
+sys.modules['pygments.formatters'] = newmod
+del newmod.newmod, newmod.oldmod, newmod.sys, newmod.types
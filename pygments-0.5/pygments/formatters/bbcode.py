@@ -11,6 +11,7 @@
 
 
 from pygments.formatter import Formatter
+from pygments.token import extend_type_table
 from pygments.util import get_bool_opt
 
 __all__ = ['BBCodeFormatter']
@@ -44,8 +45,15 @@ class BBCodeFormatter(Formatter):
         self._code = get_bool_opt(options, 'codetag', False)
         self._mono = get_bool_opt(options, 'monofont', False)
 
-        self.styles = {} 
+        # shared by all formatters with the same style; _styles maps
+        # token type ids to (start, end)
+        self.styles, self._styles = self._get_style_tables(
+            (), self._create_tables)
+
+    def _create_tables(self):
+        self.styles = {}
         self._make_styles()
+        return self.styles, []
 
     def _make_styles(self):
         for ttype, ndef in self.style:
@@ -64,7 +72,7 @@ class BBCodeFormatter(Formatter):
                 end = '[/u]' + end
             # there are no common BBcodes for background-color and border
 
-            self.styles[token] = start, end
+            self.styles[ttype] = start, end
 
     def format(self, tokensource, outfile):
         if self._code:
@@ -72,23 +80,27 @@ class BBCodeFormatter(Formatter):
         if self._mono:
             outfile.write('[font=monospace]')
 
+        styles = self._styles
         lastval = ''
-        lasttype = None
+        laststyle = None
 
         for ttype, value in tokensource:
-            while ttype not in self.styles:
-                ttype = ttype.parent
-            if ttype == lasttype:
+            try:
+                style = styles[ttype.id]
+            except IndexError:
+                extend_type_table(styles, self.styles)
+                style = styles[ttype.id]
+            if style is laststyle:
                 lastval += value
             else:
                 if lastval:
-                    start, end = self.styles[lasttype]
+                    start, end = laststyle
                     outfile.write(''.join((start, lastval, end)))
                 lastval = value
-                lasttype = ttype
+                laststyle = style
 
         if lastval:
-            start, end = self.styles[lasttype]
+            start, end = laststyle
             outfile.write(''.join((start, lastval, end)))
 
         if self._mono:
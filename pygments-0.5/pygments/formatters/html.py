@@ -8,18 +8,24 @@
     :copyright: 2006 by Georg Brandl, Armin Ronacher.
     :license: GNU LGPL, see LICENSE for more details.
 """
+import re
 import StringIO
 
 from pygments.formatter import Formatter
-from pygments.token import Token, Text, STANDARD_TYPES
+from pygments.token import Token, Text, STANDARD_TYPES, TOKEN_TYPES
 from pygments.util import get_bool_opt, get_int_opt
 
 
 __all__ = ['HtmlFormatter']
 
 
+_escape_html_search = re.compile('[&<>"\']').search
+
 def escape_html(text):
     """Escape &, <, > as well as single and double quotes for HTML."""
+    # one scan is cheaper than five replace passes if there's nothing to do
+    if _escape_html_search(text) is None:
+        return text
     return text.replace('&', '&amp;').  \
                 replace('<', '&lt;').   \
                 replace('>', '&gt;').   \
@@ -39,6 +45,12 @@ def get_random_id():
     return sha('%s|%s' % (random(), time())).hexdigest()
 
 
+#: Runs of tokens with the same span are written out up to their last
+#: line end once they are longer than this, so that they needn't be kept
+#: in memory as a whole
+RUN_FLUSH_SIZE = 16384
+
+
 def _get_ttype_class(ttype):
     fname = STANDARD_TYPES.get(ttype)
     if fname: return fname
@@ -50,7 +62,7 @@ def _get_ttype_class(ttype):
     return fname + aname
 
 
-DOC_TEMPLATE = '''\
+DOC_HEADER = '''\
 <!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01//EN"
    "http://www.w3.org/TR/html4/strict.dtd">
 
@@ -59,18 +71,61 @@ DOC_TEMPLATE = '''\
   <title>%(title)s</title>
   <style type="text/css">
 td.linenos { background-color: #f0f0f0; padding-right: 10px; }
+span.lineno { background-color: #f0f0f0; padding: 0 5px 0 5px; }
 %(styledefs)s
   </style>
 </head>
 <body>
 <h2>%(title)s</h2>
 
-%(code)s
+'''
+
+DOC_FOOTER = '''
 
 </body>
 </html>
 '''
 
+#: Inline styles of the line numbers with the `noclasses` option
+LINENO_STYLE = 'background-color: #f0f0f0; padding: 0 5px 0 5px'
+
+
+class _InlineLinenoWriter(object):
+    """
+    File-like object that writes HTML lines to ``write``, each prefixed
+    with the line number markup that ``get_lineno(number)`` returns.
+    Lines are numbered when their first character is written, so that
+    nothing is buffered.
+    """
+
+    def __init__(self, write, get_lineno, start):
+        self._write = write
+        self._get_lineno = get_lineno
+        self.lineno = start
+        self.linestart = True
+
+    def _next_lineno(self):
+        lineno = self._get_lineno(self.lineno)
+        self.lineno += 1
+        return lineno
+
+    def write(self, text):
+        if not text:
+            return
+        lines = text.split('\n')
+        parts = []
+        if self.linestart:
+            parts.append(self._next_lineno())
+        parts.append(lines[0])
+        for line in lines[1:-1]:
+            parts += ['\n', self._next_lineno(), line]
+        if len(lines) > 1:
+            parts.append('\n')
+            if lines[-1]:
+                parts += [self._next_lineno(), lines[-1]]
+        self.linestart = len(lines) > 1 and not lines[-1]
+        self._write(''.join(parts))
+
 
 class HtmlFormatter(Formatter):
     """
@@ -93,7 +148,10 @@ class HtmlFormatter(Formatter):
     ``cssstyles``
         Inline CSS styles for the wrapping <div>. (default: '').
     ``linenos``
-        If set to ``True``, output line numbers (default: False).
+        If set to ``True`` or ``'table'``, output line numbers in a
+        table cell next to the code. If set to ``'inline'``, output
+        them at the start of each line, which doesn't need to know the
+        number of lines in advance (default: False).
     ``linenostart``
         The line number for the first line (default: 1).
     ``linenostep``
@@ -116,14 +174,24 @@ class HtmlFormatter(Formatter):
         self.classprefix = options.get('classprefix', '')
         self.cssclass = options.get('cssclass', 'highlight')
         self.cssstyles = options.get('cssstyles', '')
-        self.linenos = get_bool_opt(options, 'linenos', False)
+        # 0: no line numbers, 1: line number table, 2: inline numbers
+        linenos = options.get('linenos', False)
+        if linenos == 'inline':
+            self.linenos = 2
+        elif linenos == 'table' or get_bool_opt(options, 'linenos', False):
+            self.linenos = 1
+        else:
+            self.linenos = 0
         self.linenostart = abs(get_int_opt(options, 'linenostart', 1))
         self.linenostep = abs(get_int_opt(options, 'linenostep', 1))
         self.linenospecial = abs(get_int_opt(options, 'linenospecial', 0))
         self.nobackground = get_bool_opt(options, 'nobackground', False)
 
-        self._class_cache = {}
-        self._create_stylesheet()
+        # the tables are shared by all formatters with these options;
+        # _spans maps token type ids to (opening tag, newline replacement)
+        (self.ttype2class, self.class2style, self._class_cache,
+         self._spans) = self._get_style_tables(
+            (self.classprefix, self.noclasses), self._create_tables)
 
     def _get_css_class(self, ttype):
         """Return the css class of this token type prefixed with
@@ -131,11 +199,43 @@ class HtmlFormatter(Formatter):
         if ttype in self._class_cache:
             return self._class_cache[ttype]
 
-        return self.classprefix + STANDARD_TYPES.get(ttype) or _get_ttype_class(ttype)
+        cls = _get_ttype_class(ttype)
+        # plain text has no class and isn't wrapped, even with a prefix
+        cls = self._class_cache[ttype] = cls and self.classprefix + cls
+        return cls
+
+    def _get_span(self, ttype):
+        """Return the opening <span> tag for this token type, or an empty
+        string if its tokens aren't wrapped."""
+        if self.noclasses:
+            getcls = self.ttype2class.get
+            cclass = getcls(ttype)
+            while cclass is None:
+                ttype = ttype.parent
+                cclass = getcls(ttype)
+            return cclass and '<span style="%s">' % self.class2style[cclass][0]
+        cls = self._get_css_class(ttype)
+        return cls and '<span class="%s">' % cls
+
+    def _extend_spans(self):
+        """Add the token types created since the last call to `_spans`."""
+        spans = self._spans
+        start = len(spans)
+        new = []
+        for ttype in TOKEN_TYPES[start:]:
+            cspan = self._get_span(ttype)
+            new.append((cspan, cspan and '</span>\n' + cspan or '\n'))
+        # one slice assignment, see `pygments.token.extend_type_table`
+        spans[start:start + len(new)] = new
+
+    def _create_tables(self):
+        t2c, c2s = self._create_stylesheet()
+        return t2c, c2s, {}, []
 
     def _create_stylesheet(self):
-        t2c = self.ttype2class = {Token: ''}
-        c2s = self.class2style = {}
+        """Return the ``ttype2class`` and ``class2style`` dicts."""
+        t2c = {Token: ''}
+        c2s = {}
         cp = self.classprefix
         for ttype, ndef in self.style:
             name = cp + _get_ttype_class(ttype)
@@ -157,6 +257,7 @@ class HtmlFormatter(Formatter):
                 # save len(ttype) to enable ordering the styles by
                 # hierarchy (necessary for CSS cascading rules!)
                 c2s[name] = (style[:-2], ttype, len(ttype))
+        return t2c, c2s
 
     def get_style_defs(self, arg=''):
         """
@@ -164,117 +265,167 @@ class HtmlFormatter(Formatter):
         current highlighting style. ``arg`` can be a string of selectors
         to insert before the token type classes.
         """
+        # only the rules are shared, ``arg`` can be different every time
+        rules, background = self._get_style_tables(
+            ('style_defs', self.classprefix), self._create_style_rules)
         if arg:
             arg += ' '
+        lines = [arg + rule for rule in rules]
+        if arg and not self.nobackground and background:
+            lines.insert(0, arg + background)
+        return '\n'.join(lines)
+
+    def _create_style_rules(self):
+        """Return the CSS rules without selectors and the background rule
+        (None if the style has no background color)."""
         styles = [(level, ttype, cls, style)
                   for cls, (style, ttype, level) in self.class2style.iteritems()
                   if cls and style]
         styles.sort()
-        lines = ['%s.%s { %s } /* %s */' % (arg, cls, style, repr(ttype)[6:])
-                 for level, ttype, cls, style in styles]
-        if arg and not self.nobackground and \
-           self.style.background_color is not None:
+        rules = tuple(['.%s { %s } /* %s */' % (cls, style, repr(ttype)[6:])
+                       for level, ttype, cls, style in styles])
+        background = None
+        if self.style.background_color is not None:
             text_style = ''
             if Text in self.ttype2class:
                 text_style = ' ' + self.class2style[self.ttype2class[Text]][0]
-            lines.insert(0, '%s{ background: %s;%s }' %
-                         (arg, self.style.background_color, text_style))
-        return '\n'.join(lines)
-
-    def _format_nowrap(self, tokensource, outfile, lnos=False):
+            background = '{ background: %s;%s }' % (
+                self.style.background_color, text_style)
+        return rules, background
+
+    def _get_inline_lineno(self, num):
+        """Return the markup for line ``num`` with inline line numbers."""
+        st = self.linenostep
+        sp = self.linenospecial
+        text = '%4s ' % (num % st == 0 and num or '')
+        if self.noclasses:
+            return '<span style="%s">%s</span>' % (LINENO_STYLE, text)
+        if sp and num % sp == 0:
+            return '<span class="lineno special">%s</span>' % text
+        return '<span class="lineno">%s</span>' % text
+
+    def _format_nowrap(self, tokensource, write, lnos=False):
         lncount = 0
-        nocls = self.noclasses
-        # for <span style=""> lookup only
-        getcls = self.ttype2class.get
-        c2s = self.class2style
+        spans = self._spans
+        result = []
+        append = result.append
 
-        write = outfile.write
         lspan = ''
+        lnewline = '\n'
+        values = []
+        runsize = 0
         for ttype, value in tokensource:
-            htmlvalue = escape_html(value)
+            try:
+                cspan, cnewline = spans[ttype.id]
+            except IndexError:
+                self._extend_spans()
+                cspan, cnewline = spans[ttype.id]
+            if cspan == lspan:
+                values.append(value)
+                runsize += len(value)
+                if runsize > RUN_FLUSH_SIZE and '\n' in value:
+                    # the span is closed at line ends anyway, so the
+                    # complete lines of the run can be written now
+                    run = ''.join(values)
+                    pos = run.rfind('\n') + 1
+                    htmlvalue = escape_html(run[:pos])
+                    if lnos:
+                        lncount += htmlvalue.count('\n')
+                    if lspan:
+                        append(lspan + htmlvalue[:-1].replace('\n', lnewline)
+                               + '</span>\n')
+                    else:
+                        append(htmlvalue)
+                    write(''.join(result))
+                    del result[:]
+                    values = [run[pos:]]
+                    runsize = len(values[0])
+                continue
+            if not value: # if no value, leave old span open
+                continue
+            # output the run of tokens with the previous span at once
+            htmlvalue = escape_html(''.join(values))
             if lnos:
-                lncount += value.count("\n")
-
-            if nocls:
-                cclass = getcls(ttype)
-                while cclass is None:
-                    ttype = ttype.parent
-                    cclass = getcls(ttype)
-                cspan = cclass and '<span style="%s">' % c2s[cclass][0]
+                lncount += htmlvalue.count('\n')
+            if not lspan or not htmlvalue:
+                append(htmlvalue)
+            elif htmlvalue[-1:] == '\n':
+                # don't open the span again for an empty line rest
+                append(lspan + htmlvalue[:-1].replace('\n', lnewline)
+                       + '</span>\n')
             else:
-                cls = self._get_css_class(ttype)
-                cspan = cls and '<span class="%s">' % cls
-
-            if cspan == lspan:
-                if not cspan:
-                    write(htmlvalue)
-                else:
-                    write(htmlvalue.replace('\n', '</span>\n' + cspan))
-            elif htmlvalue: # if no value, leave old span open
-                if lspan:
-                    write('</span>')
-                lspan = cspan
-                if cspan:
-                    htmlvalue = htmlvalue.replace('\n', '</span>\n' + cspan)
-                    write(cspan + htmlvalue)
-                else:
-                    write(htmlvalue)
-        if lspan:
-            write('</span>')
+                append(lspan + htmlvalue.replace('\n', lnewline) + '</span>')
+            if len(result) > 512:
+                write(''.join(result))
+                del result[:]
+            lspan, lnewline = cspan, cnewline
+            values = [value]
+            runsize = len(value)
+
+        htmlvalue = escape_html(''.join(values))
+        if lnos:
+            lncount += htmlvalue.count('\n')
+        if not lspan or not htmlvalue:
+            append(htmlvalue)
+        elif htmlvalue[-1:] == '\n':
+            append(lspan + htmlvalue[:-1].replace('\n', lnewline)
+                   + '</span>\n')
+        else:
+            append(lspan + htmlvalue.replace('\n', lnewline) + '</span>')
+        write(''.join(result))
         return lncount
 
+    def _format_table(self, tokensource, write):
+        # the line number cell comes first, so the code is kept in
+        # memory (once) until its lines are counted
+        code = []
+        lncount = self._format_nowrap(tokensource, code.append, True)
+
+        fl = self.linenostart
+        mw = len(str(lncount + fl - 1))
+        sp = self.linenospecial
+        st = self.linenostep
+        if sp:
+            ls = '\n'.join([(i%st == 0 and
+                             (i%sp == 0 and '<span class="special">%*d</span>'
+                              or '%*d') % (mw, i)
+                             or '')
+                            for i in range(fl, fl + lncount)])
+        else:
+            ls = '\n'.join([(i%st == 0 and ('%*d' % (mw, i)) or '')
+                            for i in range(fl, fl + lncount)])
+
+        write('<table><tr>'
+              '<td class="linenos" title="click to toggle" '
+              'onclick="with (this.firstChild.style) { display = '
+              '''(display == '') ? 'none' : '' }"><pre>'''
+              + ls + '</pre></td><td class="code"><pre>')
+        for piece in code:
+            write(piece)
+        write('</pre></td></tr></table>')
+
     def format(self, tokensource, outfile):
+        write = outfile.write
         if self.nowrap:
-            self._format_nowrap(tokensource, outfile)
+            self._format_nowrap(tokensource, write)
             return
 
-        realoutfile = outfile
-        lnos = self.linenos
-        full = self.full
-
-        div = ('<div' + (self.cssclass and ' class="%s" ' % self.cssclass)
-               + (self.cssstyles and ' style="%s"' % self.cssstyles) + '>')
-        if full or lnos:
-            outfile = StringIO.StringIO()
-        else:
-            outfile.write(div)
-
-        outfile.write('<pre>')
-        lncount = self._format_nowrap(tokensource, outfile, lnos)
-        outfile.write('</pre>')
-
-        ret = ''
-        if lnos:
-            fl = self.linenostart
-            mw = len(str(lncount + fl - 1))
-            sp = self.linenospecial
-            st = self.linenostep
-            if sp:
-                ls = '\n'.join([(i%st == 0 and
-                                 (i%sp == 0 and '<span class="special">%*d</span>'
-                                  or '%*d') % (mw, i)
-                                 or '')
-                                for i in range(fl, fl + lncount)])
-            else:
-                ls = '\n'.join([(i%st == 0 and ('%*d' % (mw, i)) or '')
-                                for i in range(fl, fl + lncount)])
-
-            ret = div + ('<table><tr>'
-                   '<td class="linenos" title="click to toggle" '
-                   'onclick="with (this.firstChild.style) { display = '
-                   '''(display == '') ? 'none' : '' }"><pre>'''
-                   + ls + '</pre></td><td class="code">')
-            ret += outfile.getvalue()
-            ret += '</td></tr></table>'
-
-        if full:
-            if not ret:
-                ret = div + outfile.getvalue() + '</div>\n'
-            realoutfile.write(DOC_TEMPLATE %
-                dict(title     = self.title,
-                     styledefs = self.get_style_defs('body'),
-                     code      = ret))
-        elif lnos:
-            realoutfile.write(ret + '</div>\n')
+        # everything but the line number table is written as it comes
+        if self.full:
+            write(DOC_HEADER % dict(title     = self.title,
+                                    styledefs = self.get_style_defs('body')))
+        write('<div' + (self.cssclass and ' class="%s" ' % self.cssclass)
+              + (self.cssstyles and ' style="%s"' % self.cssstyles) + '>')
+        if self.linenos == 1:
+            self._format_table(tokensource, write)
         else:
-            realoutfile.write('</div>\n')
+            write('<pre>')
+            if self.linenos == 2:
+                write = _InlineLinenoWriter(write, self._get_inline_lineno,
+                                            self.linenostart).write
+            self._format_nowrap(tokensource, write)
+            write = outfile.write
+            write('</pre>')
+        write('</div>\n')
+        if self.full:
+            write(DOC_FOOTER)
@@ -11,7 +11,7 @@
 import StringIO
 
 from pygments.formatter import Formatter
-from pygments.token import Token
+from pygments.token import Token, extend_type_table
 from pygments.util import get_bool_opt, get_int_opt
 
 
@@ -80,12 +80,19 @@ class LatexFormatter(Formatter):
         self.verboptions = options.get('verboptions', '')
         self.nobackground = get_bool_opt(options, 'nobackground', False)
 
-        self._create_stylecmds()
+        # shared by all formatters with the same style; _cmds maps token
+        # type ids to commands
+        self.ttype2cmd, self.cmd2def, self._cmds = \
+            self._get_style_tables((), self._create_tables)
 
+    def _create_tables(self):
+        t2c, c2d = self._create_stylecmds()
+        return t2c, c2d, []
 
     def _create_stylecmds(self):
-        t2c = self.ttype2cmd = {Token: ''}
-        c2d = self.cmd2def = {}
+        """Return the ``ttype2cmd`` and ``cmd2def`` dicts."""
+        t2c = {Token: ''}
+        c2d = {}
 
         letters = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
         first = iter(letters)
@@ -133,6 +140,7 @@ class LatexFormatter(Formatter):
                 alias = 'C' + firstl + second.next()
             t2c[ttype] = alias
             c2d[alias] = cmndef
+        return t2c, c2d
 
     def get_style_defs(self, arg=''):
         """
@@ -140,6 +148,10 @@ class LatexFormatter(Formatter):
         used to format text in the verbatim environment. If ``arg`` is
         given and true, use \\renewcommand instead.
         """
+        return self._get_style_tables(('style_defs', bool(arg)),
+                                      lambda: self._create_style_defs(arg))
+
+    def _create_style_defs(self, arg):
         nc = (arg and r'\renewcommand' or r'\newcommand')
         return '%s\\at{@}\n%s\\lb{[}\n%s\\rb{]}\n' % (nc, nc, nc) + \
                '\n'.join(['%s\\%s[1]{%s}' % (nc, alias, cmndef)
@@ -163,12 +175,14 @@ class LatexFormatter(Formatter):
             outfile.write(',' + self.verboptions)
         outfile.write(']\n')
 
+        cmds = self._cmds
         for ttype, value in tokensource:
             value = escape_tex(value)
-            cmd = self.ttype2cmd.get(ttype)
-            while cmd is None:
-                ttype = ttype.parent
-                cmd = self.ttype2cmd.get(ttype)
+            try:
+                cmd = cmds[ttype.id]
+            except IndexError:
+                extend_type_table(cmds, self.ttype2cmd)
+                cmd = cmds[ttype.id]
             if cmd:
                 spl = value.split('\n')
                 for line in spl[:-1]:
@@ -3,16 +3,23 @@
     pygments.formatters.other
     ~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    Other formatters: NullFormatter, RawTokenFormatter.
+    Other formatters: NullFormatter, RawTokenFormatter,
+    BinaryTokenFormatter.
 
     :copyright: 2006 by Georg Brandl, Armin Ronacher.
     :license: GNU LGPL, see LICENSE for more details.
 """
+import sys
+import struct
+from array import array
 
 from pygments.formatter import Formatter
+from pygments.filter import coalesce_tokens
+from pygments.binarytokens import BINARY_MAGIC, BINARY_COMPRESSIONS, \
+     BINARY_BLOCK_HEADER, BLOCK_STR, BLOCK_UNICODE, BLOCK_MIXED
 
 
-__all__ = ['NullFormatter', 'RawTokenFormatter']
+__all__ = ['NullFormatter', 'RawTokenFormatter', 'BinaryTokenFormatter']
 
 
 class NullFormatter(Formatter):
@@ -59,15 +66,106 @@ class RawTokenFormatter(Formatter):
             write = outfile.write
             flush = outfile.flush
 
-        lasttype = None
-        lastval = ''
+        for ttype, value in coalesce_tokens(tokensource):
+            write("%s\t%r\n" % (ttype, value))
+        flush()
+
+
+class BinaryTokenFormatter(Formatter):
+    """
+    Output a compact binary token representation for storing token
+    streams, which the `BinaryTokenLexer` reads much faster than the
+    `RawTokenLexer` reads the output of the `RawTokenFormatter`.
+
+    The stream consists of blocks of up to ``blocksize`` tokens. Each
+    block holds the names of the token types that appear first in it,
+    the type numbers and lengths of its tokens in arrays, and the token
+    values (encoded as UTF-8 if they are unicode).
+
+    Additional options accepted:
+
+    ``compress``
+        If set to "zlib" or "bz2", compress the token stream with
+        the given compression algorithm (default: '').
+    ``blocksize``
+        The number of tokens in a block (default: 8192).
+    """
+
+    def __init__(self, **options):
+        Formatter.__init__(self, **options)
+        self.compress = options.get('compress', '')
+        if self.compress not in BINARY_COMPRESSIONS:
+            raise ValueError('unknown compression %r' % self.compress)
+        self.blocksize = max(int(options.get('blocksize', 8192)), 1)
+
+    def format(self, tokensource, outfile):
+        outfile.write(BINARY_MAGIC + BINARY_COMPRESSIONS[self.compress])
+        if self.compress == 'zlib':
+            import zlib
+            compressor = zlib.compressobj(6)
+        elif self.compress == 'bz2':
+            import bz2
+            compressor = bz2.BZ2Compressor(9)
+        else:
+            compressor = None
+        if compressor:
+            def write(data):
+                outfile.write(compressor.compress(data))
+        else:
+            write = outfile.write
+
+        typeids = {}
+        newtypes = []
+        ids = []
+        values = []
+        add_id = ids.append
+        add_value = values.append
+        blocksize = self.blocksize
         for ttype, value in tokensource:
-            if ttype is lasttype:
-                lastval += value
+            try:
+                add_id(typeids[ttype])
+            except KeyError:
+                if len(typeids) == 0x10000:
+                    raise ValueError('too many token types')
+                typeids[ttype] = len(typeids)
+                add_id(typeids[ttype])
+                newtypes.append(ttype)
+            add_value(value)
+            if len(ids) == blocksize:
+                write(self._format_block(newtypes, ids, values))
+                del newtypes[:], ids[:], values[:]
+        if ids:
+            write(self._format_block(newtypes, ids, values))
+        if compressor:
+            outfile.write(compressor.flush())
+        outfile.flush()
+
+    def _format_block(self, newtypes, ids, values):
+        names = '\n'.join(map(repr, newtypes))
+        ids = array('H', ids)
+        flags = ''
+        try:
+            data = ''.join(values)
+        except UnicodeDecodeError:
+            # non-ASCII byte strings and unicode strings
+            kind = BLOCK_MIXED
+            flags = array('B', [isinstance(value, unicode)
+                                for value in values]).tostring()
+            values = [isinstance(value, unicode) and value.encode('utf-8')
+                      or value for value in values]
+            data = ''.join(values)
+        else:
+            if isinstance(data, unicode):
+                kind = BLOCK_UNICODE
+                data = data.encode('utf-8')
             else:
-                if lasttype:
-                    write("%s\t%r\n" % (lasttype, lastval))
-                lastval = value
-                lasttype = ttype
-        write("%s\t%r\n" % (lasttype, lastval))
-        flush()
+                kind = BLOCK_STR
+        lengths = array('I', map(len, values))
+        if sys.byteorder == 'big':
+            ids.byteswap()
+            lengths.byteswap()
+        return ''.join([struct.pack(BINARY_BLOCK_HEADER, kind,
+                                    len(newtypes), len(names), len(ids),
+                                    len(data)),
+                        names, ids.tostring(), lengths.tostring(), flags,
+                        data])
@@ -11,9 +11,9 @@
 
 from pygments.formatter import Formatter
 from pygments.token import Keyword, Name, Comment, String, Error, \
-     Number, Operator, Generic, Token
-from pygments.console import ansiformat
-from pygments.util import get_bool_opt
+     Number, Operator, Generic, Token, extend_type_table
+from pygments.console import ansi_escapes, codes
+from pygments.util import get_bool_opt, OptionError
 
 
 __all__ = ['TerminalFormatter']
@@ -51,6 +51,41 @@ TERMINAL_COLORS = {
 }
 
 
+#: The levels of the red, green and blue components of the colors 16 to
+#: 231 of 256-color terminals
+_XTERM_LEVELS = (0, 0x5f, 0x87, 0xaf, 0xd7, 0xff)
+
+#: ``(prefix, suffix)`` tables for the builtin colorscheme, by ``darkbg``
+_default_escapes = {}
+
+
+def _nearest_level(value):
+    best = 0
+    for i, level in enumerate(_XTERM_LEVELS):
+        if abs(level - value) < abs(_XTERM_LEVELS[best] - value):
+            best = i
+    return best
+
+
+def xterm256_color(rgb):
+    """
+    Return the number of the color of the 256-color palette that is
+    closest to the hex color ``rgb`` (e.g. ``'ff8000'``).
+    """
+    r, g, b = [int(rgb[i:i+2], 16) for i in (0, 2, 4)]
+    ri, gi, bi = [_nearest_level(c) for c in (r, g, b)]
+    cube = (_XTERM_LEVELS[ri], _XTERM_LEVELS[gi], _XTERM_LEVELS[bi])
+    # the 24 grays from 232 on are 8, 18, ..., 238
+    grayi = min(max(((r + g + b) // 3 - 3) // 10, 0), 23)
+    gray = 8 + 10 * grayi
+    def distance(color):
+        return ((color[0] - r) ** 2 + (color[1] - g) ** 2 +
+                (color[2] - b) ** 2)
+    if distance((gray, gray, gray)) < distance(cube):
+        return 232 + grayi
+    return 16 + 36 * ri + 6 * gi + bi
+
+
 class TerminalFormatter(Formatter):
     """
     Output plain text with coloring ANSI sequences.
@@ -68,31 +103,110 @@ class TerminalFormatter(Formatter):
             ``None`` or a dictionary mapping token types to
             ``(lightbg, darkbg)`` color names.
 
+        ``colors``
+            ``'16'`` to use the colors of the colorscheme, ``'256'`` or
+            ``'truecolor'`` to use the colors of the style, as far as
+            the terminal supports them (default: ``'16'``).
+
         ``debug``
             If true, output "<<ERROR>>" after each error token.
         """
         Formatter.__init__(self, **options)
         self.darkbg = options.get('bg', 'light') == 'dark'
         self.colorscheme = options.get('colorscheme', None) or TERMINAL_COLORS
+        self.colors = str(options.get('colors', '16'))
         self.debug = get_bool_opt(options, 'debug', False)
 
+        # _escapes maps token type ids to (prefix, suffix) escape
+        # sequences, or None for uncolored text
+        if self.colors == '16':
+            if self.colorscheme is TERMINAL_COLORS:
+                # setdefault, so that threads creating the first
+                # formatters at the same time share the same tables
+                escapes = _default_escapes.get(self.darkbg)
+                if escapes is None:
+                    escapes = _default_escapes.setdefault(
+                        self.darkbg, self._create_colorscheme_escapes())
+                self._escape_map, self._escapes = escapes
+            else:
+                self._escape_map, self._escapes = \
+                    self._create_colorscheme_escapes()
+        elif self.colors in ('256', 'truecolor'):
+            self._escape_map, self._escapes = self._get_style_tables(
+                (self.colors,), self._create_style_escapes)
+        else:
+            raise OptionError('Invalid value %r for option colors; use '
+                              '16, 256 or truecolor' % self.colors)
+
+    def _create_colorscheme_escapes(self):
+        escape_map = {}
+        for ttype, pair in self.colorscheme.iteritems():
+            escape_map[ttype] = pair and ansi_escapes(pair[self.darkbg]) \
+                                or None
+        return escape_map, []
+
+    def _get_color_code(self, rgb, background):
+        if self.colors == 'truecolor':
+            return '%d;2;%d;%d;%d' % (background and 48 or 38,
+                                      int(rgb[0:2], 16), int(rgb[2:4], 16),
+                                      int(rgb[4:6], 16))
+        return '%d;5;%d' % (background and 48 or 38, xterm256_color(rgb))
+
+    def _create_style_escapes(self):
+        escape_map = {}
+        for ttype, ndef in self.style:
+            attrs = []
+            if ndef['bold']:
+                attrs.append('01')
+            if ndef['italic']:
+                attrs.append('03')
+            if ndef['underline']:
+                attrs.append('04')
+            if ndef['color']:
+                attrs.append(self._get_color_code(ndef['color'], False))
+            if ndef['bgcolor']:
+                attrs.append(self._get_color_code(ndef['bgcolor'], True))
+            escape_map[ttype] = attrs and \
+                ('\x1b[' + ';'.join(attrs) + 'm', codes['reset']) or None
+        return escape_map, []
+
     def format(self, tokensource, outfile):
         dbg = self.debug
+        escapes = self._escapes
+        write = outfile.write
+        result = []
+        append = result.append
         for ttype, value in tokensource:
-            color = self.colorscheme.get(ttype)
-            while color is None:
-                ttype = ttype[:-1]
-                color = self.colorscheme.get(ttype)
-            if color:
-                color = color[self.darkbg]
-                spl = value.split('\n')
-                for line in spl[:-1]:
-                    if line:
-                        outfile.write(ansiformat(color, line))
-                    outfile.write('\n')
-                if spl[-1]:
-                    outfile.write(ansiformat(color, spl[-1]))
-            else:
-                outfile.write(value)
+            try:
+                escape = escapes[ttype.id]
+            except IndexError:
+                extend_type_table(escapes, self._escape_map)
+                escape = escapes[ttype.id]
+            if escape is None:
+                append(value)
+            elif '\n' in value:
+                # color sequences end at newlines, for pagers; the
+                # lines go to ``result`` one by one, as long values
+                # (e.g. coalesced runs) would be copied twice otherwise
+                prefix, suffix = escape
+                start = 0
+                end = value.find('\n')
+                while end != -1:
+                    if end > start:
+                        append(prefix + value[start:end] + suffix)
+                    append('\n')
+                    if len(result) > 512:
+                        write(''.join(result))
+                        del result[:]
+                    start = end + 1
+                    end = value.find('\n', start)
+                if start < len(value):
+                    append(prefix + value[start:] + suffix)
+            elif value:
+                append(escape[0] + value + escape[1])
             if dbg and ttype is Error:
-                outfile.write('<<ERROR>>')
+                append('<<ERROR>>')
+            if len(result) > 512:
+                write(''.join(result))
+                del result[:]
+        write(''.join(result))
@@ -9,6 +9,7 @@
     :license: GNU LGPL, see LICENSE for more details.
 """
 import re
+import bisect
 
 try:
     set
@@ -20,12 +21,40 @@ from pygments.util import get_bool_opt, get_int_opt, make_analysator
 
 
 __all__ = ['Lexer', 'RegexLexer', 'ExtendedRegexLexer', 'DelegatingLexer',
-           'LexerContext', 'include', 'flags', 'bygroups', 'using', 'this']
+           'LexerContext', 'IncrementalLexer', 'include', 'flags', 'bygroups',
+           'using', 'this']
 
 
 _default_analyse = staticmethod(lambda x: 0.0)
 
 
+def _read_lines(infile, chunksize):
+    """
+    Read ``infile`` in chunks of ``chunksize`` characters and yield its
+    text in pieces of whole lines with ``\\n`` line breaks.
+    """
+    pending = ''
+    while 1:
+        data = infile.read(chunksize)
+        if not data:
+            break
+        data = pending + data
+        end = max(data.rfind('\n'), data.rfind('\r')) + 1
+        if end == len(data) and data[-1] == '\r':
+            # could be the first half of a \r\n
+            end = max(data.rfind('\n', 0, end - 1),
+                      data.rfind('\r', 0, end - 1)) + 1
+        pending = data[end:]
+        if end:
+            yield type(data)('\n').join(data[:end].splitlines()) + '\n'
+    if pending:
+        lines = pending.splitlines()
+        text = type(pending)('\n').join(lines)
+        if pending.splitlines(True)[-1] != lines[-1]:
+            text += '\n'
+        yield text
+
+
 class LexerMeta(type):
     """
     This metaclass automagically converts ``analyse_text`` methods into
@@ -67,6 +96,9 @@ class Lexer(object):
     #: mime types
     mimetypes = []
 
+    #: If true, `get_tokens_unprocessed` can lex buffer objects in place
+    accepts_buffers = False
+
     __metaclass__ = LexerMeta
 
     def __init__(self, **options):
@@ -74,6 +106,8 @@ class Lexer(object):
         self.stripnl = get_bool_opt(options, 'stripnl', True)
         self.stripall = get_bool_opt(options, 'stripall', False)
         self.tabsize = get_int_opt(options, 'tabsize', 0)
+        #: lexers created by `using` callbacks, by class and options
+        self._sublexers = {}
 
     def __repr__(self):
         if self.options:
@@ -101,20 +135,112 @@ class Lexer(object):
         Return an iterable of (tokentype, value) pairs generated from ``text``.
 
         Also preprocess the text, i.e. expand tabs and strip it if wanted.
+
+        ``text`` can also be an `mmap.mmap`. Lexers that accept buffers
+        lex it in place if the preprocessing needn't change more than
+        its start and end; otherwise it is copied into a string.
         """
-        text = type(text)('\n').join(text.splitlines())
-        if self.stripall:
-            text = text.strip()
-        elif self.stripnl:
-            text = text.strip('\n')
-        if self.tabsize > 0:
-            text = text.expandtabs(self.tabsize)
-        if not text.endswith('\n'):
-            text += '\n'
+        view = None
+        if not isinstance(text, basestring):
+            if self.accepts_buffers:
+                view = self._get_buffer_view(text)
+            if view is None:
+                text = text[:]
+        if view is not None:
+            text = view
+        else:
+            text = type(text)('\n').join(text.splitlines())
+            if self.stripall:
+                text = text.strip()
+            elif self.stripnl:
+                text = text.strip('\n')
+            if self.tabsize > 0:
+                text = text.expandtabs(self.tabsize)
+            if not text.endswith('\n'):
+                text += '\n'
 
         for i, t, v in self.get_tokens_unprocessed(text):
             yield t, v
 
+    def _get_buffer_view(self, buf):
+        """
+        Return a `buffer` over the part of ``buf`` that `get_tokens` would
+        lex, or None if the text must be changed for that.
+        """
+        if self.tabsize > 0 or buf.find('\r') >= 0:
+            return None
+        size = len(buf)
+        start = 0
+        if self.stripall or self.stripnl:
+            if self.stripall:
+                chars = ' \t\n\x0b\x0c'
+            else:
+                chars = '\n'
+            while start < size and buf[start] in chars:
+                start += 1
+            end = size
+            while end > start and buf[end-1] in chars:
+                end -= 1
+            if end == start or buf[end:end+1] != '\n':
+                # the newline added by get_tokens isn't there
+                return None
+            end += 1
+        elif buf[size-2:size] == '\n\n':
+            # splitlines() loses the last line break
+            end = size - 1
+        elif buf[size-1:size] == '\n':
+            end = size
+        else:
+            return None
+        return buffer(buf, start, end - start)
+
+    def get_tokens_stream(self, infile, chunksize=65536):
+        """
+        Like `get_tokens`, but read the text from the file object
+        ``infile``. Lexers that can resume lexing at line boundaries read
+        it in chunks of ``chunksize`` characters and yield the tokens of
+        each chunk before reading on; this lexer reads the whole text.
+        """
+        return self.get_tokens(infile.read())
+
+    def _read_preprocessed(self, infile, chunksize):
+        """
+        Read ``infile`` in chunks and preprocess the text like
+        `get_tokens`. Yield pieces of the resulting text.
+        """
+        started = False
+        held = last = ''
+        for text in _read_lines(infile, chunksize):
+            if not started:
+                if self.stripall:
+                    text = text.lstrip()
+                elif self.stripnl:
+                    text = text.lstrip('\n')
+                if not text:
+                    continue
+                started = True
+            # pieces start at line boundaries, except for the first one,
+            # where the text stripped from the start doesn't count
+            if self.tabsize > 0:
+                text = text.expandtabs(self.tabsize)
+            text = held + text
+            # hold back what would be stripped at the end of the input
+            if self.stripall:
+                keep = text.rstrip()
+            elif self.stripnl:
+                keep = text.rstrip('\n')
+            elif text[-1:] == '\n':
+                # get_tokens loses the last line break with splitlines()
+                keep = text[:-1]
+            else:
+                keep = text
+            held = text[len(keep):]
+            if keep:
+                yield keep
+                last = keep
+        if not last.endswith('\n'):
+            yield '\n'
+
     def get_tokens_unprocessed(self, text):
         """
         Return an iterable of (tokentype, value) pairs.
@@ -124,16 +250,100 @@ class Lexer(object):
         raise NotImplementedError
 
 
+class _Queue(object):
+    """
+    A first-in first-out queue, like ``collections.deque`` which is not
+    available in Python 2.3.
+    """
+
+    def __init__(self):
+        self._items = []
+        self._start = 0
+
+    def __len__(self):
+        return len(self._items) - self._start
+
+    def append(self, item):
+        self._items.append(item)
+
+    def popleft(self):
+        items = self._items
+        item = items[self._start]
+        self._start += 1
+        if self._start * 2 > len(items):
+            # drop the items taken so far
+            del items[:self._start]
+            self._start = 0
+        return item
+
+
+class _DelegatedText(object):
+    """
+    Splits the tokens of a `DelegatingLexer`'s language lexer into the
+    text for the root lexer and the language tokens to insert into the
+    root lexer's token stream. The tokens are only read as far as the
+    consumers of `pieces` and `insertions` need.
+    """
+
+    def __init__(self, tokens, needle):
+        self._tokens = iter(tokens)
+        self._needle = needle
+        self._pieces = _Queue()
+        self._insertions = _Queue()
+        self._buflen = 0
+        self._lng_buffer = []
+        self._done = False
+
+    def _read(self):
+        """Read up to the next root lexer token; return false at the end."""
+        for i, t, v in self._tokens:
+            if t is self._needle:
+                if self._lng_buffer:
+                    self._insertions.append((self._buflen, self._lng_buffer))
+                    self._lng_buffer = []
+                self._pieces.append(v)
+                self._buflen += len(v)
+                return True
+            self._lng_buffer.append((i, t, v))
+        if self._lng_buffer:
+            self._insertions.append((self._buflen, self._lng_buffer))
+            self._lng_buffer = []
+        self._done = True
+        return False
+
+    def pieces(self):
+        """Yield the pieces of the text for the root lexer."""
+        pieces = self._pieces
+        while pieces or self._read():
+            while pieces:
+                yield pieces.popleft()
+
+    def insertions(self):
+        """Yield the insertions for `do_insertions`."""
+        insertions = self._insertions
+        while insertions or not self._done:
+            if insertions:
+                yield insertions.popleft()
+            else:
+                self._read()
+
+
 class DelegatingLexer(Lexer):
     """
     This lexer takes two lexer as arguments. A root lexer and
-    a language lexer. First everything is scanned using the language
-    lexer, afterwards all ``Other`` tokens are lexed using the root
+    a language lexer. Everything is scanned using the language
+    lexer, and all ``Other`` tokens are lexed using the root
     lexer.
 
+    If the root lexer is a `RegexLexer`, both lexers run side by side:
+    the text of the ``Other`` tokens is lexed in chunks as it comes in.
+
     The lexers from the ``template`` lexer package use this base lexer.
     """
 
+    #: The root lexer can look this many characters ahead
+    chunksize = 65536
+
     def __init__(self, _root_lexer, _language_lexer, _needle=Other, **options):
         self.root_lexer = _root_lexer(**options)
         self.language_lexer = _language_lexer(**options)
@@ -141,21 +351,30 @@ class DelegatingLexer(Lexer):
         Lexer.__init__(self, **options)
 
     def get_tokens_unprocessed(self, text):
-        buffered = ''
+        if isinstance(self.root_lexer, RegexLexer):
+            delegated = _DelegatedText(
+                self.language_lexer.get_tokens_unprocessed(text), self.needle)
+            return do_insertions(delegated.insertions(), self.root_lexer.
+                                 _lex_chunked(delegated.pieces(),
+                                              self.chunksize))
+
+        buffered = []
+        buflen = 0
         insertions = []
         lng_buffer = []
         for i, t, v in self.language_lexer.get_tokens_unprocessed(text):
             if t is self.needle:
                 if lng_buffer:
-                    insertions.append((len(buffered), lng_buffer))
+                    insertions.append((buflen, lng_buffer))
                     lng_buffer = []
-                buffered += v
+                buffered.append(v)
+                buflen += len(v)
             else:
                 lng_buffer.append((i, t, v))
         if lng_buffer:
-            insertions.append((len(buffered), lng_buffer))
-        return do_insertions(insertions,
-                             self.root_lexer.get_tokens_unprocessed(buffered))
+            insertions.append((buflen, lng_buffer))
+        return do_insertions(insertions, self.root_lexer.
+                             get_tokens_unprocessed(''.join(buffered)))
 
 
 #-------------------------------------------------------------------------------
@@ -253,10 +472,23 @@ def using(_other, **kwargs):
             if ctx:
                 ctx.pos = match.end()
     else:
+        # the lexer options override the keyword arguments
+        items = kwargs.items()
+        items.sort()
+        key = (_other, tuple(items))
+        try:
+            hash(key)
+        except TypeError:
+            key = (_other, id(kwargs))
+
         def callback(lexer, match, ctx=None):
-            # XXX: cache that somehow
-            kwargs.update(lexer.options)
-            lx = _other(**kwargs)
+            # sub-lexers are created once per lexer instance
+            try:
+                lx = lexer._sublexers[key]
+            except KeyError:
+                options = kwargs.copy()
+                options.update(lexer.options)
+                lx = lexer._sublexers[key] = _other(**options)
 
             s = match.start()
             for i, t, v in lx.get_tokens_unprocessed(match.group()):
@@ -266,6 +498,14 @@ def using(_other, **kwargs):
     return callback
 
 
+#: Rules whose patterns use inline flags (which apply to the whole regex),
+#: backreferences or conditionals can't be put into a merged alternation.
+_unmergeable_re = re.compile(r'\(\?[iLmsux]+\)|\\[1-9]|\(\?P=|\(\?\(')
+
+#: sre can't handle more than 100 groups in one pattern.
+_MAX_MERGED_GROUPS = 99
+
+
 class RegexLexerMeta(LexerMeta):
     """
     Metaclass for RegexLexer, creates the self._tokens attribute from
@@ -330,13 +570,74 @@ class RegexLexerMeta(LexerMeta):
             tokens.append((rex, tdef[1], new_state))
         return tokens
 
-    def __call__(cls, *args, **kwds):
+    def _merge_state(cls, tokens):
+        """
+        Compile runs of consecutive rules in a processed state into one
+        alternation regex with a named group per rule. Python's regex
+        engine tries alternatives from left to right, so the first rule
+        that matches still wins.
+
+        The result is a list in the same ``(rex, action, new_state)``
+        format, except that a merged run is represented as
+        ``(combined_rex, None, {groupname: rule})``. Rules that can't be
+        merged (inline flags, backreferences) are left alone and split
+        the runs.
+        """
+        rflags = cls.flags
+        if rflags & re.VERBOSE:
+            # a trailing comment would swallow the closing parenthesis
+            template = '(?P<_%d>%s\n)'
+        else:
+            template = '(?P<_%d>%s)'
+        result = []
+        run = []
+        ngroups = 0
+
+        def flush():
+            if len(run) < 2:
+                result.extend(run)
+            else:
+                parts = []
+                rules = {}
+                for i, rule in enumerate(run):
+                    parts.append(template % (i, rule[0].pattern))
+                    rules['_%d' % i] = rule
+                try:
+                    rex = re.compile('|'.join(parts), rflags)
+                except (re.error, AssertionError, OverflowError):
+                    result.extend(run)
+                else:
+                    result.append((rex, None, rules))
+            del run[:]
+
+        for rule in tokens:
+            rex = rule[0]
+            if _unmergeable_re.search(rex.pattern):
+                flush()
+                ngroups = 0
+                result.append(rule)
+                continue
+            if ngroups + rex.groups + 1 > _MAX_MERGED_GROUPS:
+                flush()
+                ngroups = 0
+            run.append(rule)
+            ngroups += rex.groups + 1
+        flush()
+        return result
+
+    def _process_tokens(cls):
+        """Create ``cls._tokens`` from ``cls.tokens`` if not done yet."""
         if not hasattr(cls, '_tokens'):
             cls._tokens = {}
             cls._tmpname = 0
             for state in cls.tokens.keys():
                 cls._process_state(state)
+            if cls.merge_states:
+                for state, tokens in cls._tokens.items():
+                    cls._tokens[state] = cls._merge_state(tokens)
 
+    def __call__(cls, *args, **kwds):
+        cls._process_tokens()
         return type.__call__(cls, *args, **kwds)
 
 
@@ -371,19 +672,43 @@ class RegexLexer(Lexer):
     #: current one.
     tokens = {}
 
-    def get_tokens_unprocessed(self, text, stack=('root',)):
+    #: If true, consecutive rules of a state are compiled into one
+    #: alternation regex so that each token costs a single regex call.
+    merge_states = True
+
+    accepts_buffers = True
+
+    def get_tokens_unprocessed(self, text, stack=('root',), context=None):
         """
         Split ``text`` into (tokentype, text) pairs.
 
         ``stack`` is the inital stack (default: ``['root']``)
+
+        If ``context`` is given, start at the position and with the state
+        stack stored in this lexer context instead (``stack`` if the
+        context's stack is empty). If its ``checkpoints`` attribute is a
+        list, ``(offset, stack)`` pairs are appended to it at every line
+        boundary reached between two matches.
         """
-        pos = 0
-        statestack = list(stack)
+        if context is None:
+            pos = 0
+            statestack = list(stack)
+            checkpoints = None
+        else:
+            pos = context.pos
+            statestack = list(context.stack or stack)
+            checkpoints = context.checkpoints
         statetokens = self._tokens[statestack[-1]]
         while 1:
             for rex, action, new_state in statetokens:
                 m = rex.match(text, pos)
                 if m:
+                    if action is None:
+                        # merged rules, look up the one that matched
+                        rex, action, new_state = new_state[m.lastgroup]
+                        if type(action) is not _TokenType:
+                            # callbacks need the rule's own group numbers
+                            m = rex.match(text, pos)
                     if type(action) is _TokenType:
                         yield pos, action, m.group()
                     else:
@@ -402,21 +727,92 @@ class RegexLexer(Lexer):
                         else:
                             assert False, "wrong state def: %r" % new_state
                         statetokens = self._tokens[statestack[-1]]
+                    if checkpoints is not None and text[pos-1:pos] == '\n':
+                        checkpoints.append((pos, tuple(statestack)))
                     break
             else:
                 try:
                     if text[pos] == '\n':
                         # at EOL, reset state to "root"
+                        yield pos, Text, '\n'
                         pos += 1
                         statestack = ['root']
                         statetokens = self._tokens['root']
-                        yield pos, Text, '\n'
+                        if checkpoints is not None:
+                            checkpoints.append((pos, ('root',)))
                         continue
                     yield pos, Error, text[pos]
                     pos += 1
                 except IndexError:
                     break
 
+    def get_tokens_stream(self, infile, chunksize=65536):
+        """
+        Like `get_tokens`, but read the text from the file object
+        ``infile`` in chunks of ``chunksize`` characters.
+        """
+        for i, t, v in self._lex_chunked(
+            self._read_preprocessed(infile, chunksize), chunksize):
+            yield t, v
+
+    def _lex_chunked(self, pieces, chunksize):
+        """
+        Lex the text made of the strings in the iterable ``pieces`` and
+        yield ``(index, tokentype, value)`` tuples, reading only as many
+        pieces as needed to yield the next tokens.
+
+        The text is lexed in parts that end at line boundaries; lexing
+        the next part resumes with the state stack found there. Tokens
+        are only yielded if at least ``chunksize`` characters of text
+        follow them, so that rules can look that far ahead.
+        """
+        parts = []
+        size = 0
+        # the part is lexed once it is this long; if lexing it makes
+        # little progress (no line boundaries), the part must grow more
+        # until the next try, so that the text isn't lexed over and over
+        needed = 2 * chunksize
+        # offset of the current part in the text
+        base = 0
+        # an empty stack makes the lexer start with its initial stack
+        stack = []
+        for text in pieces:
+            parts.append(text)
+            size += len(text)
+            if size < needed:
+                continue
+            buf = ''.join(parts)
+            ctx = LexerContext(buf, 0)
+            ctx.stack = list(stack)
+            ctx.checkpoints = checkpoints = []
+            limit = len(buf) - chunksize
+            offset = 0
+            tokens = []
+            for i, t, v in self.get_tokens_unprocessed(buf, context=ctx):
+                if checkpoints:
+                    # the tokens so far end at this line boundary
+                    pos, cpstack = checkpoints[-1]
+                    del checkpoints[:]
+                    if pos > limit:
+                        break
+                    for i2, t2, v2 in tokens:
+                        yield base + i2, t2, v2
+                    tokens = []
+                    offset = pos
+                    stack = cpstack
+                tokens.append((i, t, v))
+            buf = buf[offset:]
+            base += offset
+            parts = [buf]
+            size = len(buf)
+            needed = max(2 * chunksize, 2 * size)
+        if size:
+            buf = ''.join(parts)
+            ctx = LexerContext(buf, 0)
+            ctx.stack = list(stack)
+            for i, t, v in self.get_tokens_unprocessed(buf, context=ctx):
+                yield base + i, t, v
+
 
 class LexerContext(object):
     """
@@ -428,6 +824,8 @@ class LexerContext(object):
         self.pos = pos
         self.end = end or len(text) # end=0 not supported ;-)
         self.stack = stack or ['root']
+        #: if set to a list, the lexer records line boundary checkpoints
+        self.checkpoints = None
 
     def __repr__(self):
         return 'LexerContext(%r, %r, %r)' % (
@@ -449,12 +847,24 @@ class ExtendedRegexLexer(RegexLexer):
             statetokens = self._tokens['root']
         else:
             ctx = context
+            if not ctx.stack:
+                ctx.stack = ['root']
             statetokens = self._tokens[ctx.stack[-1]]
             text = ctx.text
+        # callbacks may lex on with the same context, only the outermost
+        # loop knows real line boundaries
+        checkpoints = ctx.checkpoints
+        ctx.checkpoints = None
         while 1:
             for rex, action, new_state in statetokens:
                 m = rex.match(text, ctx.pos, ctx.end)
                 if m:
+                    if action is None:
+                        # merged rules, look up the one that matched
+                        rex, action, new_state = new_state[m.lastgroup]
+                        if type(action) is not _TokenType:
+                            # callbacks need the rule's own group numbers
+                            m = rex.match(text, ctx.pos, ctx.end)
                     if type(action) is _TokenType:
                         yield ctx.pos, action, m.group()
                         ctx.pos = m.end()
@@ -477,6 +887,9 @@ class ExtendedRegexLexer(RegexLexer):
                         else:
                             assert False, "wrong state def: %r" % new_state
                         statetokens = self._tokens[ctx.stack[-1]]
+                    if checkpoints is not None and \
+                       text[ctx.pos-1:ctx.pos] == '\n':
+                        checkpoints.append((ctx.pos, tuple(ctx.stack)))
                     break
             else:
                 try:
@@ -484,10 +897,12 @@ class ExtendedRegexLexer(RegexLexer):
                         break
                     if text[ctx.pos] == '\n':
                         # at EOL, reset state to "root"
+                        yield ctx.pos, Text, '\n'
                         ctx.pos += 1
                         ctx.stack = ['root']
                         statetokens = self._tokens['root']
-                        yield ctx.pos, Text, '\n'
+                        if checkpoints is not None:
+                            checkpoints.append((ctx.pos, ('root',)))
                         continue
                     yield ctx.pos, Error, text[ctx.pos]
                     ctx.pos += 1
@@ -495,7 +910,113 @@ class ExtendedRegexLexer(RegexLexer):
                     break
 
 
-def do_insertions(insertions, tokens):
+class IncrementalLexer(object):
+    """
+    Keeps the token stream of a text lexed by a `RegexLexer` or
+    `ExtendedRegexLexer` together with ``(offset, stack, tokenindex)``
+    checkpoints at line boundaries. After an edit, lexing resumes at the
+    nearest checkpoint before the edit and stops as soon as the state
+    stack at a line boundary behind the edit equals the old one.
+
+    The text is lexed as given, i.e. without the preprocessing done by
+    `Lexer.get_tokens`; it should use ``\\n`` line endings. ``tokens``
+    is a list of ``(tokentype, value)`` pairs.
+
+    Rules may look ahead beyond the end of their match, so lexing resumes
+    ``lookback`` lines before the edited one, and goes back further (twice
+    as far each time) as long as tokens before the edit come out
+    differently than before. An edit can still change tokens further up
+    without changing any token in between: a rule that looked ahead over
+    several unchanged lines, or failed after scanning for the end of a
+    string or comment that the edit now ends. Such tokens are not
+    updated; raise ``lookback`` for lexers where this matters.
+    """
+
+    def __init__(self, lexer, text, stack=('root',), lookback=1):
+        self.lexer = lexer
+        self.text = text
+        self.lookback = lookback
+        self.tokens = []
+        self.checkpoints = [(0, tuple(stack), 0)]
+        self._relex(0, None, None, 0)
+
+    def update(self, start, end, newtext):
+        """
+        Replace ``text[start:end]`` with ``newtext`` and lex the affected
+        part again. Return a ``(index, removed, added)`` tuple: ``removed``
+        tokens starting at ``index`` were replaced by ``added`` new ones.
+        """
+        self.text = self.text[:start] + newtext + self.text[end:]
+        cpidx = bisect.bisect_left(self.checkpoints, (start,)) - 1
+        step = self.lookback + 1
+        cpidx = max(cpidx - self.lookback, 0)
+        limit = start
+        while True:
+            result = self._relex(cpidx, limit, start + len(newtext),
+                                 len(newtext) - (end - start))
+            if result is not None:
+                return result
+            # a token before the edit changed, so tokens before the
+            # checkpoint may change as well: start further back until
+            # the tokens there stay the same
+            limit = self.checkpoints[cpidx][0]
+            cpidx = max(cpidx - step, 0)
+            step *= 2
+
+    def _relex(self, cpidx, limit, stop, delta):
+        """
+        Lex from checkpoint ``cpidx`` until the state converges behind
+        ``stop``. Return None without changing anything if a token that
+        ends before ``limit`` differs from the old one.
+        """
+        offset, stack, first = self.checkpoints[cpidx]
+        ctx = LexerContext(self.text, offset, list(stack))
+        ctx.checkpoints = found = []
+        oldcps = self.checkpoints
+        oldtokens = self.tokens
+        # the text before ``limit`` is unchanged, and so should be the
+        # tokens there
+        compare = cpidx > 0 and limit is not None
+        tokens = []
+        checkpoints = []
+        tail = None
+        for i, t, v in self.lexer.get_tokens_unprocessed(self.text,
+                                                         context=ctx):
+            if compare:
+                if i + len(v) > limit:
+                    compare = False
+                elif oldtokens[first + len(tokens)] != (t, v):
+                    return None
+            if found:
+                for pos, stack in found:
+                    if checkpoints and checkpoints[-1][0] == pos:
+                        checkpoints.pop()
+                    checkpoints.append((pos, stack, first + len(tokens)))
+                del found[:]
+                pos, stack = checkpoints[-1][:2]
+                if stop is not None and pos >= stop:
+                    old = bisect.bisect_left(oldcps, (pos - delta,))
+                    if old < len(oldcps) and oldcps[old][0] == pos - delta \
+                       and oldcps[old][1] == stack:
+                        tail = old
+                        checkpoints.pop()
+                        break
+            tokens.append((t, v))
+
+        if tail is None:
+            removed = len(self.tokens) - first
+            self.checkpoints[cpidx+1:] = checkpoints
+        else:
+            removed = oldcps[tail][2] - first
+            shift = len(tokens) - removed
+            self.checkpoints[cpidx+1:] = checkpoints + \
+                [(pos + delta, stack, idx + shift)
+                 for pos, stack, idx in oldcps[tail:]]
+        self.tokens[first:first+removed] = tokens
+        return first, removed, len(tokens)
+
+
+def do_insertions(insertions, tokens, start=0):
     """
     Helper for lexers which must combine the results of several
     sublexers.
@@ -503,32 +1024,56 @@ def do_insertions(insertions, tokens):
     ``insertions`` is a list of ``(index, itokens)`` pairs.
     Each ``itokens`` iterable should be inserted at position
     ``index`` into the token stream given by the ``tokens``
-    argument.
-
-    The result is a combined token stream.
+    argument. The indices in each ``itokens`` must be consecutive, as
+    yielded by a lexer; they are moved to the insertion point.
 
-    XXX: The indices yielded by this function are not correct!
+    The result is a combined token stream, whose indices are the
+    positions in the combined text, counted from ``start``.
     """
     insertions = iter(insertions)
     try:
         index, itokens = insertions.next()
     except StopIteration:
-        # no insertions
-        for item in tokens:
-            yield item
-        return
+        index = None
 
-    insleft = True
+    # offset of the indices of ``tokens`` in the combined text
+    shift = start
     for i, t, v in tokens:
+        if index is None or i + len(v) < index:
+            yield i + shift, t, v
+            continue
         oldi = 0
-        while insleft and i + len(v) >= index:
-            yield i, t, v[oldi:index-i]
+        while index is not None and i + len(v) >= index:
+            # the part of the token up to the insertion point
+            if index > i + oldi:
+                yield i + oldi + shift, t, v[oldi:index-i]
+            pos = index + shift
+            delta = None
             for item in itokens:
+                if delta is None:
+                    delta = pos - item[0]
+                if delta:
+                    item = (item[0] + delta, item[1], item[2])
                 yield item
-            oldi = index-i
+            if delta is not None:
+                pos = item[0] + len(item[2])
+            shift = pos - index
+            oldi = index - i
             try:
                 index, itokens = insertions.next()
             except StopIteration:
-                insleft = False
-                break  # not strictly necessary
-        yield i, t, v[oldi:]
+                index = None
+        if oldi < len(v):
+            yield i + oldi + shift, t, v[oldi:]
+
+    # insertions after the end of the token stream
+    while index is not None:
+        pos = index + shift
+        for _, it, iv in itokens:
+            yield pos, it, iv
+            pos += len(iv)
+        shift = pos - index
+        try:
+            index, itokens = insertions.next()
+        except StopIteration:
+            index = None
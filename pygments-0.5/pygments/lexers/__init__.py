@@ -8,17 +8,19 @@
     :copyright: 2006 by Georg Brandl.
     :license: GNU LGPL, see LICENSE for more details.
 """
+import re
 import fnmatch
 import types
-from os.path import basename
+from os.path import basename, normcase
 
 try:
     set
 except NameError:
     from sets import Set as set
 
-from pygments.lexers._mapping import LEXERS
-from pygments.plugin import find_plugin_lexers
+from pygments.lexers._mapping import LEXERS, ANALYSERS
+from pygments.plugin import find_plugin_lexers, register_clear_hook
+from pygments.util import get_shebang_interpreter, get_modeline_mode
 
 
 __all__ = ['get_lexer_by_name', 'get_lexer_for_filename',
@@ -26,6 +28,23 @@ __all__ = ['get_lexer_by_name', 'get_lexer_for_filename',
 
 _lexer_cache = {}
 
+#: Lookup indexes built by `_init_indexes`: dicts that map aliases,
+#: mimetypes and exact filenames or ``*.ext`` patterns to builtin lexer
+#: names (keys of `LEXERS`) or plugin lexer classes, a list of
+#: ``(pattern, lexer)`` pairs for filename patterns that need fnmatch and
+#: a flag that tells if plugin lexers are in the indexes. Plugin
+#: discovery is slow, so they are only added when no builtin lexer matches
+#: a lookup. The tuple is only ever replaced as a whole, so that lookups
+#: in other threads never see partly built indexes.
+_indexes = None
+
+#: `guess_lexer` only analyses this many characters of the text
+_GUESS_PREFIX_SIZE = 8192
+
+_analysers = set(ANALYSERS)
+_interpreter_suffix_re = re.compile(r'(\.(exe|cmd|bat|bin))?$')
+_interpreter_version_re = re.compile(r'[\d.]+$')
+
 
 def _load_lexers(module_name):
     """
@@ -37,54 +56,135 @@ def _load_lexers(module_name):
         _lexer_cache[cls.name] = cls
 
 
+def _is_glob(pattern):
+    """Return true if ``pattern`` can't be looked up in a dict."""
+    if pattern[:1] == '*':
+        pattern = pattern[1:]
+        if pattern[:1] != '.':
+            return True
+    for char in '*?[':
+        if char in pattern:
+            return True
+    return False
+
+
+def _add_to_indexes(indexes, lexer, aliases, filenames, mimetypes):
+    alias_index, mimetype_index, filename_index, filename_globs = indexes[:4]
+    for alias in aliases:
+        alias_index.setdefault(alias, lexer)
+    for mimetype in mimetypes:
+        mimetype_index.setdefault(mimetype, lexer)
+    for filename in filenames:
+        if _is_glob(filename):
+            filename_globs.append((filename, lexer))
+        else:
+            filename_index.setdefault(normcase(filename), lexer)
+
+
+def _init_indexes(plugins=False):
+    """Return the lookup indexes, building them if needed."""
+    global _indexes
+    indexes = _indexes
+    if indexes is None:
+        # builtin lexers come first, like in a linear search
+        indexes = ({}, {}, {}, [], False)
+        for lexer_name, (_, _, aliases, filenames, mimetypes) in \
+            LEXERS.iteritems():
+            _add_to_indexes(indexes, lexer_name, aliases, filenames,
+                            mimetypes)
+        if _indexes is None:
+            _indexes = indexes
+    if plugins and not indexes[4]:
+        # extend copies, the published indexes must not change
+        indexes = (indexes[0].copy(), indexes[1].copy(), indexes[2].copy(),
+                   indexes[3][:], True)
+        for cls in find_plugin_lexers():
+            _add_to_indexes(indexes, cls, cls.aliases, cls.filenames,
+                            cls.mimetypes)
+        _indexes = indexes
+    return indexes
+
+
+def _lookup(find, key):
+    """
+    Return ``find(indexes, key)`` for the indexes of the builtin lexers,
+    or for those of the plugin lexers too if that is None.
+    """
+    indexes = _init_indexes()
+    lexer = find(indexes, key)
+    if lexer is None and not indexes[4]:
+        lexer = find(_init_indexes(plugins=True), key)
+    return lexer
+
+
+def _find_alias(indexes, alias):
+    return indexes[0].get(alias)
+
+
+def _find_mimetype(indexes, mimetype):
+    return indexes[1].get(mimetype)
+
+
+def _clear_indexes():
+    global _indexes
+    _indexes = None
+
+register_clear_hook(_clear_indexes)
+
+
+def _get_lexer_class(lexer):
+    """Return the class for an index entry."""
+    if isinstance(lexer, str):
+        module_name, name = LEXERS[lexer][:2]
+        if name not in _lexer_cache:
+            _load_lexers(module_name)
+        return _lexer_cache[name]
+    return lexer
+
+
 def get_lexer_by_name(_alias, **options):
     """
     Get a lexer by an alias.
     """
-    # lookup builtin lexers
-    for module_name, name, aliases, _, _ in LEXERS.itervalues():
-        if _alias in aliases:
-            if name not in _lexer_cache:
-                _load_lexers(module_name)
-            return _lexer_cache[name](**options)
-    # continue with lexers from setuptools entrypoints
-    for cls in find_plugin_lexers():
-        if _alias in cls.aliases:
-            return cls(**options)
-    raise ValueError('no lexer for alias %r found' % _alias)
+    lexer = _lookup(_find_alias, _alias)
+    if lexer is None:
+        raise ValueError('no lexer for alias %r found' % _alias)
+    return _get_lexer_class(lexer)(**options)
+
+
+def _find_filename(indexes, fn):
+    # exact filenames, then "*.ext" patterns for every possible extension
+    filename_index = indexes[2]
+    lexer = filename_index.get(fn)
+    pos = fn.find('.')
+    while lexer is None and pos >= 0:
+        lexer = filename_index.get('*' + fn[pos:])
+        pos = fn.find('.', pos + 1)
+    if lexer is None:
+        for pattern, glob_lexer in indexes[3]:
+            if fnmatch.fnmatch(fn, pattern):
+                return glob_lexer
+    return lexer
 
 
 def get_lexer_for_filename(_fn, **options):
     """
     Get a lexer for a filename.
     """
-    fn = basename(_fn)
-    for modname, name, _, filenames, _ in LEXERS.itervalues():
-        for filename in filenames:
-            if fnmatch.fnmatch(fn, filename):
-                if name not in _lexer_cache:
-                    _load_lexers(modname)
-                return _lexer_cache[name](**options)
-    for cls in find_plugin_lexers():
-        for filename in cls.filenames:
-            if fnmatch.fnmatch(fn, filename):
-                return cls(**options)
-    raise ValueError('no lexer for filename %r found' % _fn)
+    lexer = _lookup(_find_filename, normcase(basename(_fn)))
+    if lexer is None:
+        raise ValueError('no lexer for filename %r found' % _fn)
+    return _get_lexer_class(lexer)(**options)
 
 
 def get_lexer_for_mimetype(_mime, **options):
     """
     Get a lexer for a mimetype.
     """
-    for modname, name, _, _, mimetypes in LEXERS.itervalues():
-        if _mime in mimetypes:
-            if name not in _lexer_cache:
-                _load_lexers(modname)
-            return _lexer_cache[name](**options)
-    for cls in find_plugin_lexers():
-        if _mime in cls.mimetypes:
-            return cls(**options)
-    raise ValueError('no lexer for mimetype %r found' % _mime)
+    lexer = _lookup(_find_mimetype, _mime)
+    if lexer is None:
+        raise ValueError('no lexer for mimetype %r found' % _mime)
+    return _get_lexer_class(lexer)(**options)
 
 
 def _iter_lexerclasses():
@@ -142,15 +242,57 @@ def guess_lexer_for_filename(_fn, _text, **options):
     return result[-1][1](**options)
 
 
+def _iter_analyser_classes():
+    """
+    Returns an iterator over all lexer classes that can analyse text.
+    Only the modules containing such lexers are imported.
+    """
+    # same order as _iter_lexerclasses, so that ties are decided the same
+    for lexer_name in LEXERS:
+        if lexer_name in _analysers:
+            yield _get_lexer_class(lexer_name)
+    for lexer in find_plugin_lexers():
+        yield lexer
+
+
+def _guess_lexer_by_hints(text):
+    """
+    Return the lexer class for the language a modeline or the shebang
+    names if a lexer has this alias.
+    """
+    names = []
+    mode = get_modeline_mode(text)
+    if mode is not None:
+        names.append(mode)
+    interpreter = get_shebang_interpreter(text)
+    if interpreter is not None:
+        name = _interpreter_suffix_re.sub('', interpreter)
+        names += [name, _interpreter_version_re.sub('', name)]
+    for name in names:
+        lexer = _lookup(_find_alias, name)
+        if lexer is not None:
+            return _get_lexer_class(lexer)
+    return None
+
+
 def guess_lexer(_text, **options):
     """
     Guess a lexer by strong distinctions in the text (eg, shebang).
+
+    An Emacs or Vim modeline or a shebang naming a known lexer alias
+    decides at once. Otherwise the `analyse_text` functions of the lexers
+    that have one are run over the start of the text; the first lexer
+    that is certain or the one with the best score wins.
     """
     #XXX: i (mitsuhiko) would like to drop this function in favor of the
     #     better guess_lexer_for_filename function.
+    lexer = _guess_lexer_by_hints(_text)
+    if lexer is not None:
+        return lexer(**options)
+    text = _text[:_GUESS_PREFIX_SIZE]
     best_lexer = [0.0, None]
-    for lexer in _iter_lexerclasses():
-        rv = lexer.analyse_text(_text)
+    for lexer in _iter_analyser_classes():
+        rv = lexer.analyse_text(text)
         if rv == 1.0:
             return lexer(**options)
         if rv > best_lexer[0]:
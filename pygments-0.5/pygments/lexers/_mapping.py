@@ -7,13 +7,14 @@
     you change something on a builtin lexer defintion, run this script from
     the lexers folder to update it.
 
-    Do not alter the LEXERS dictionary by hand.
+    Do not alter the LEXERS dictionary or the ANALYSERS tuple by hand.
 
     :copyright: 2006 by Armin Ronacher, Georg Brandl.
     :license: GNU LGPL, see LICENSE for more details.
 """
 
 LEXERS = {
+    'BinaryTokenLexer': ('pygments.lexers.special', 'Binary token data', ('bintokens',), ('*.btok',), ('application/x-pygments-tokens-binary',)),
     'BooLexer': ('pygments.lexers.dotnet', 'Boo', ('boo',), ('*.boo',), ('text/x-boo',)),
     'BrainfuckLexer': ('pygments.lexers.other', 'Brainfuck', ('bf', 'brainfuck'), ('*.b', '*.bf'), ()),
     'CLexer': ('pygments.lexers.compiled', 'C', ('c',), ('*.c', '*.h'), ('text/x-chdr', 'text/x-csrc')),
@@ -67,13 +68,47 @@ LEXERS = {
     'XmlSmartyLexer': ('pygments.lexers.templates', 'XML+Smarty', ('xml+smarty',), (), ())
 }
 
+ANALYSERS = (
+    'CssDjangoLexer',
+    'CssErbLexer',
+    'CssGenshiLexer',
+    'CssPhpLexer',
+    'CssSmartyLexer',
+    'DjangoLexer',
+    'ErbLexer',
+    'GenshiLexer',
+    'HtmlDjangoLexer',
+    'HtmlGenshiLexer',
+    'HtmlLexer',
+    'HtmlPhpLexer',
+    'HtmlSmartyLexer',
+    'JavascriptDjangoLexer',
+    'JavascriptErbLexer',
+    'JavascriptGenshiLexer',
+    'JavascriptPhpLexer',
+    'JavascriptSmartyLexer',
+    'PerlLexer',
+    'PhpLexer',
+    'PythonLexer',
+    'RhtmlLexer',
+    'RubyLexer',
+    'SmartyLexer',
+    'XmlDjangoLexer',
+    'XmlErbLexer',
+    'XmlLexer',
+    'XmlPhpLexer',
+    'XmlSmartyLexer'
+)
+
 if __name__ == '__main__':
     import sys
     import os
 
     # lookup lexers
     found_lexers = []
+    found_analysers = []
     sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+    from pygments.lexer import Lexer
     for filename in os.listdir('.'):
         if filename.endswith('.py') and not filename.startswith('_'):
             module_name = 'pygments.lexers.%s' % filename[:-3]
@@ -88,8 +123,12 @@ if __name__ == '__main__':
                                  tuple(lexer.aliases),
                                  tuple(lexer.filenames),
                                  tuple(lexer.mimetypes))))
+                # lexers that can't analyse text are skipped by guess_lexer
+                if lexer.analyse_text is not Lexer.analyse_text:
+                    found_analysers.append(repr(lexer_name))
     # sort them, that should make the diff files for svn smaller
     found_lexers.sort()
+    found_analysers.sort()
 
     # extract useful sourcecode from this file
     f = file(__file__)
@@ -104,5 +143,6 @@ if __name__ == '__main__':
     f = file(__file__, 'w')
     f.write(header)
     f.write('LEXERS = {\n    %s\n}\n\n' % ',\n    '.join(found_lexers))
+    f.write('ANALYSERS = (\n    %s\n)\n\n' % ',\n    '.join(found_analysers))
     f.write(footer)
     f.close()
@@ -10,16 +10,13 @@
 """
 
 import re
-try:
-    set
-except NameError:
-    from sets import Set as set
 
 from pygments.lexer import Lexer, RegexLexer, ExtendedRegexLexer, \
      LexerContext, include, combined, do_insertions, bygroups
 from pygments.token import Error, Text, \
      Comment, Operator, Keyword, Name, String, Number, Generic
-from pygments.util import get_bool_opt, get_list_opt, shebang_matches
+from pygments.util import get_bool_opt, get_list_opt, shebang_matches, \
+     get_builtin_names
 
 
 __all__ = ['PythonLexer', 'PythonConsoleLexer', 'RubyLexer',
@@ -164,22 +161,28 @@ class PythonConsoleLexer(Lexer):
     def get_tokens_unprocessed(self, text):
         pylexer = PythonLexer(**self.options)
 
-        curcode = ''
+        curcode = []
+        codelen = codestart = 0
         insertions = []
         tb = 0
         for match in line_re.finditer(text):
             line = match.group()
             if line.startswith('>>> ') or line.startswith('... '):
                 tb = 0
-                insertions.append((len(curcode),
+                if not curcode:
+                    codestart = match.start()
+                insertions.append((codelen,
                                    [(0, Generic.Prompt, line[:4])]))
-                curcode += line[4:]
+                curcode.append(line[4:])
+                codelen += len(line) - 4
             else:
                 if curcode:
                     for item in do_insertions(insertions,
-                                    pylexer.get_tokens_unprocessed(curcode)):
+                                    pylexer.get_tokens_unprocessed(
+                                        ''.join(curcode)), codestart):
                         yield item
-                    curcode = ''
+                    curcode = []
+                    codelen = 0
                     insertions = []
                 if line.startswith('Traceback (most recent call last):'):
                     tb = 1
@@ -191,8 +194,8 @@ class PythonConsoleLexer(Lexer):
                 else:
                     yield match.start(), Generic.Output, line
         if curcode:
-            for item in do_insertions(insertions,
-                                      pylexer.get_tokens_unprocessed(curcode)):
+            for item in do_insertions(insertions, pylexer.
+                    get_tokens_unprocessed(''.join(curcode)), codestart):
                 yield item
 
 
@@ -222,7 +225,7 @@ class RubyLexer(ExtendedRegexLexer):
         ctx.end = match.end(5)
         # this may find other heredocs
         for i, t, v in self.get_tokens_unprocessed(context=ctx):
-            yield i+start, t, v
+            yield i, t, v
         ctx.pos = match.end()
 
         if outermost:
@@ -246,6 +249,8 @@ class RubyLexer(ExtendedRegexLexer):
                     # end of heredoc not found -- error!
                     for amatch in lines:
                         yield amatch.start(), Error, amatch.group()
+                    if lines:
+                        ctx.pos = lines[-1].end()
             ctx.end = len(ctx.text)
             del heredocstack[:]
 
@@ -531,27 +536,33 @@ class RubyConsoleLexer(Lexer):
     def get_tokens_unprocessed(self, text):
         rblexer = RubyLexer(**self.options)
 
-        curcode = ''
+        curcode = []
+        codelen = codestart = 0
         insertions = []
         for match in line_re.finditer(text):
             line = match.group()
             m = self._prompt_re.match(line)
             if m is not None:
                 end = m.end()
-                insertions.append((len(curcode),
+                if not curcode:
+                    codestart = match.start()
+                insertions.append((codelen,
                                    [(0, Generic.Prompt, line[:end])]))
-                curcode += line[end:]
+                curcode.append(line[end:])
+                codelen += len(line) - end
             else:
                 if curcode:
                     for item in do_insertions(insertions,
-                                    rblexer.get_tokens_unprocessed(curcode)):
+                                    rblexer.get_tokens_unprocessed(
+                                        ''.join(curcode)), codestart):
                         yield item
-                    curcode = ''
+                    curcode = []
+                    codelen = 0
                     insertions = []
                 yield match.start(), Generic.Output, line
         if curcode:
-            for item in do_insertions(insertions,
-                                      rblexer.get_tokens_unprocessed(curcode)):
+            for item in do_insertions(insertions, rblexer.
+                    get_tokens_unprocessed(''.join(curcode)), codestart):
                 yield item
 
 
@@ -762,17 +773,15 @@ class LuaLexer(RegexLexer):
             options, 'func_name_highlighting', True)
         self.disabled_modules = get_list_opt(options, 'disabled_module', [])
 
-        self._functions = set()
+        self._functions = ()
         if self.func_name_highlighting:
-            from pygments.lexers._luabuiltins import MODULES
-            for mod, func in MODULES.iteritems():
-                if mod not in self.disabled_modules:
-                    self._functions.update(func)
+            self._functions = get_builtin_names(
+                'pygments.lexers._luabuiltins', self.disabled_modules)
         RegexLexer.__init__(self, **options)
 
-    def get_tokens_unprocessed(self, text):
+    def get_tokens_unprocessed(self, text, context=None):
         for index, token, value in \
-            RegexLexer.get_tokens_unprocessed(self, text):
+            RegexLexer.get_tokens_unprocessed(self, text, context=context):
             if token is Name:
                 if value in self._functions:
                     yield index, Name.Function, value
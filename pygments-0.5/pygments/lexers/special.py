@@ -10,13 +10,19 @@
 """
 
 import re
+import sys
+import struct
 import cStringIO
+from array import array
+from itertools import izip
 
 from pygments.lexer import Lexer
 from pygments.token import Token, Error, Text
+from pygments.binarytokens import BINARY_MAGIC, BINARY_COMPRESSIONS, \
+     BINARY_BLOCK_HEADER, BLOCK_UNICODE, BLOCK_MIXED
 
 
-__all__ = ['TextLexer', 'RawTokenLexer']
+__all__ = ['TextLexer', 'RawTokenLexer', 'BinaryTokenLexer']
 
 
 class TextLexer(Lexer):
@@ -28,9 +34,23 @@ class TextLexer(Lexer):
     def get_tokens_unprocessed(self, text):
         yield 0, Text, text
 
+    def get_tokens_stream(self, infile, chunksize=65536):
+        for text in self._read_preprocessed(infile, chunksize):
+            yield Text, text
+
 
 _ttype_cache = {}
 
+def _get_ttype(ttypestr):
+    """Return the token type named ``ttypestr``, e.g. ``'Token.Name'``."""
+    ttype = _ttype_cache.get(ttypestr)
+    if ttype is None:
+        ttype = Token
+        for ttype_ in ttypestr.split('.')[1:]:
+            ttype = getattr(ttype, ttype_)
+        _ttype_cache[ttypestr] = ttype
+    return ttype
+
 line_re = re.compile('.*?\n')
 
 class RawTokenLexer(Lexer):
@@ -71,13 +91,206 @@ class RawTokenLexer(Lexer):
                 val = match.group()
                 ttype = Error
             else:
-                ttype = _ttype_cache.get(ttypestr)
-                if not ttype:
-                    ttype = Token
-                    ttypes = ttypestr.split('.')[1:]
-                    for ttype_ in ttypes:
-                        ttype = getattr(ttype, ttype_)
-                    _ttype_cache[ttypestr] = ttype
-                val = val[1:-2].decode('string-escape')
+                ttype = _get_ttype(ttypestr)
+                if val[:1] == 'u':
+                    val = val[2:-2].decode('unicode-escape')
+                else:
+                    val = val[1:-2].decode('string-escape')
             yield length, ttype, val
             length += len(val)
+
+
+class _DecompressingReader(object):
+    """
+    Reads the data that ``read(chunksize)`` calls return and passes it
+    through ``decompressor``, a zlib or bz2 decompression object or
+    None. Decompression errors are raised as `ValueError`.
+    """
+
+    def __init__(self, read, decompressor, chunksize):
+        self._read = read
+        self._decompressor = decompressor
+        self._chunksize = chunksize
+        self._buf = ''
+        self._pos = 0
+
+    def _read_chunk(self, size):
+        while 1:
+            data = self._read(max(self._chunksize, size))
+            if not data or self._decompressor is None:
+                return data
+            try:
+                data = self._decompressor.decompress(data)
+            except Exception, err:
+                raise ValueError(str(err))
+            # the decompressor may need more input to output anything
+            if data:
+                return data
+
+    def read(self, size):
+        """Return ``size`` bytes, or less at the end of the data."""
+        end = self._pos + size
+        if end > len(self._buf):
+            parts = [self._buf[self._pos:]]
+            have = len(parts[0])
+            while have < size:
+                data = self._read_chunk(size - have)
+                if not data:
+                    break
+                parts.append(data)
+                have += len(data)
+            self._buf = ''.join(parts)
+            self._pos = 0
+            end = size
+        result = self._buf[self._pos:end]
+        self._pos = end
+        return result
+
+    def read_rest(self):
+        """Return the rest of the data, or as much of it as is readable."""
+        parts = [self._buf[self._pos:]]
+        self._buf = ''
+        self._pos = 0
+        try:
+            while 1:
+                data = self._read_chunk(0)
+                if not data:
+                    break
+                parts.append(data)
+        except ValueError:
+            pass
+        return ''.join(parts)
+
+
+def _parse_block(block, ttypes):
+    """
+    Parse a block of a binary token stream. Add the new token types to
+    ``ttypes`` and return the type numbers and lengths of the tokens, the
+    token data and, for a `BLOCK_MIXED` block, the unicode flags of the
+    tokens (else None). Raise `ValueError` if the block is invalid.
+    """
+    headersize = struct.calcsize(BINARY_BLOCK_HEADER)
+    kind, nnew, nameslen, ntokens, datalen = \
+        struct.unpack(BINARY_BLOCK_HEADER, block[:headersize])
+    pos = headersize + nameslen
+    if nnew:
+        try:
+            names = [_get_ttype(name) for name in
+                     block[headersize:pos].split('\n')]
+        except AttributeError:
+            raise ValueError('invalid token type')
+        if len(names) != nnew:
+            raise ValueError('invalid token types')
+        ttypes.extend(names)
+    ids = array('H')
+    lengths = array('I')
+    end = pos + ids.itemsize * ntokens
+    ids.fromstring(block[pos:end])
+    pos, end = end, end + lengths.itemsize * ntokens
+    lengths.fromstring(block[pos:end])
+    flags = None
+    if kind == BLOCK_MIXED:
+        flags = array('B')
+        pos, end = end, end + ntokens
+        flags.fromstring(block[pos:end])
+    elif kind > BLOCK_MIXED:
+        raise ValueError('invalid block kind')
+    data = block[end:]
+    if sys.byteorder == 'big':
+        ids.byteswap()
+        lengths.byteswap()
+    if kind == BLOCK_UNICODE:
+        data = data.decode('utf-8')
+    if ids and max(ids) >= len(ttypes) or sum(lengths) != len(data):
+        raise ValueError('invalid token block')
+    return ids, lengths, data, flags
+
+
+class BinaryTokenLexer(Lexer):
+    """
+    Recreate a token stream formatted with the BinaryTokenFormatter.
+    The compression of the stream is detected from its header.
+    """
+    name = 'Binary token data'
+    aliases = ['bintokens']
+    filenames = ['*.btok']
+    mimetypes = ['application/x-pygments-tokens-binary']
+
+    def get_tokens(self, text):
+        # the stream is not text, so it isn't preprocessed
+        for i, t, v in self.get_tokens_unprocessed(text):
+            yield t, v
+
+    def get_tokens_stream(self, infile, chunksize=65536):
+        for i, t, v in self._read_tokens(infile.read, chunksize):
+            yield t, v
+
+    def get_tokens_unprocessed(self, text):
+        if not isinstance(text, str):
+            text = text[:]
+        return self._read_tokens(cStringIO.StringIO(text).read, 65536)
+
+    def _read_tokens(self, read, chunksize):
+        header = read(len(BINARY_MAGIC) + 1)
+        method = header[len(BINARY_MAGIC):]
+        if method == 'z':
+            import zlib
+            decompressor = zlib.decompressobj()
+        elif method == 'b':
+            import bz2
+            decompressor = bz2.BZ2Decompressor()
+        else:
+            decompressor = None
+        reader = _DecompressingReader(read, decompressor, chunksize)
+        if header[:-1] != BINARY_MAGIC or \
+           method not in BINARY_COMPRESSIONS.values():
+            # not a binary token stream
+            yield 0, Error, header + reader.read_rest()
+            return
+
+        headersize = struct.calcsize(BINARY_BLOCK_HEADER)
+        ttypes = []
+        index = 0
+        # the stream header belongs to the error token if the first block
+        # is invalid already, so that invalid input comes back unchanged
+        prefix = header
+        while 1:
+            block = ''
+            try:
+                block = reader.read(headersize)
+                if not block:
+                    break
+                if len(block) < headersize:
+                    raise ValueError('truncated block')
+                kind, nnew, nameslen, ntokens, datalen = \
+                    struct.unpack(BINARY_BLOCK_HEADER, block)
+                size = nameslen + 6 * ntokens + datalen
+                if kind == BLOCK_MIXED:
+                    size += ntokens
+                block += reader.read(size)
+                if len(block) < headersize + size:
+                    raise ValueError('truncated block')
+                ids, lengths, data, flags = _parse_block(block, ttypes)
+            except ValueError:
+                # yield the undecodable rest like the RawTokenLexer
+                yield index, Error, prefix + block + reader.read_rest()
+                return
+            prefix = ''
+            pos = 0
+            if flags is None:
+                for tid, length in izip(ids, lengths):
+                    end = pos + length
+                    yield index + pos, ttypes[tid], data[pos:end]
+                    pos = end
+            else:
+                # the lengths are those of the encoded values
+                bytepos = 0
+                for tid, length, isunicode in izip(ids, lengths, flags):
+                    end = bytepos + length
+                    value = data[bytepos:end]
+                    if isunicode:
+                        value = value.decode('utf-8')
+                    yield index + pos, ttypes[tid], value
+                    pos += len(value)
+                    bytepos = end
+            index += pos
@@ -10,16 +10,12 @@
 """
 
 import re
-try:
-    set
-except NameError:
-    from sets import Set as set
 
 from pygments.lexer import Lexer, RegexLexer, bygroups, using
 from pygments.token import \
      Text, Comment, Operator, Keyword, Name, String, Number, Other
 from pygments.util import get_bool_opt, get_list_opt, looks_like_xml, \
-                          html_doctype_matches
+                          html_doctype_matches, get_builtin_names
 
 
 __all__ = ['HtmlLexer', 'XmlLexer', 'JavascriptLexer', 'CssLexer',
@@ -283,21 +279,19 @@ class PhpLexer(RegexLexer):
             options, 'disabledmodules', ['unknown'])
         self.startinline = get_bool_opt(options, 'startinline', False)
 
-        # collect activated functions in a set
-        self._functions = set()
+        # the activated functions, this set is shared between instances
+        self._functions = ()
         if self.funcnamehighlighting:
-            from pygments.lexers._phpbuiltins import MODULES
-            for key, value in MODULES.iteritems():
-                if key not in self.disabledmodules:
-                    self._functions.update(value)
+            self._functions = get_builtin_names(
+                'pygments.lexers._phpbuiltins', self.disabledmodules)
         RegexLexer.__init__(self, **options)
 
-    def get_tokens_unprocessed(self, text):
+    def get_tokens_unprocessed(self, text, context=None):
         stack = ['root']
         if self.startinline:
             stack.append('php')
         for index, token, value in \
-            RegexLexer.get_tokens_unprocessed(self, text, stack):
+            RegexLexer.get_tokens_unprocessed(self, text, stack, context):
             if token is Name.Other:
                 if value in self._functions:
                     yield index, Name.Function, value
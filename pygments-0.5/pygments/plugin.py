@@ -30,32 +30,80 @@
     :copyright: 2006 by Armin Ronacher.
     :license: GNU LGPL, see LICENSE for more details.
 """
-try:
-    import pkg_resources
-except ImportError:
-    pkg_resources = None
+_not_imported = object()
+
+#: The ``pkg_resources`` module, None if setuptools isn't installed.
+#: Importing it is slow, so this is done on the first plugin lookup.
+pkg_resources = _not_imported
 
 LEXER_ENTRY_POINT = 'pygments.lexers'
 FORMATTER_ENTRY_POINT = 'pygments.formatters'
 STYLE_ENTRY_POINT = 'pygments.styles'
 
+#: Maps entry point groups to lists of ``(name, loaded object)`` pairs.
+_entrypoint_cache = {}
+
+#: Functions called by `clear_plugin_cache`.
+_clear_hooks = []
+
+
+def _get_pkg_resources():
+    global pkg_resources
+    if pkg_resources is _not_imported:
+        try:
+            import pkg_resources as module
+        except ImportError:
+            module = None
+        pkg_resources = module
+    return pkg_resources
+
+
+def _load_entrypoints(group):
+    """
+    Return the loaded entry points of ``group``. They are looked up
+    only once per process, until `clear_plugin_cache` is called.
+    """
+    try:
+        return _entrypoint_cache[group]
+    except KeyError:
+        pass
+    result = []
+    pkg_resources = _get_pkg_resources()
+    if pkg_resources is not None:
+        for entrypoint in pkg_resources.iter_entry_points(group):
+            result.append((entrypoint.name, entrypoint.load()))
+    _entrypoint_cache[group] = result
+    return result
+
+
+def clear_plugin_cache():
+    """
+    Forget all plugins found so far, e.g. after new distributions have
+    been activated. Lookup tables built from them are reset too.
+    """
+    _entrypoint_cache.clear()
+    for hook in _clear_hooks:
+        hook()
+
+
+def register_clear_hook(hook):
+    """
+    Register a function that resets a lookup table built from plugins.
+    It is called by `clear_plugin_cache`.
+    """
+    _clear_hooks.append(hook)
+
 
 def find_plugin_lexers():
-    if pkg_resources is None:
-        return
-    for entrypoint in pkg_resources.iter_entry_points(LEXER_ENTRY_POINT):
-        yield entrypoint.load()
+    for name, lexer in _load_entrypoints(LEXER_ENTRY_POINT):
+        yield lexer
 
 
 def find_plugin_formatters():
-    if pkg_resources is None:
-        return
-    for entrypoint in pkg_resources.iter_entry_points(FORMATTER_ENTRY_POINT):
-        yield entrypoint.name, entrypoint.load()
+    for name, formatter in _load_entrypoints(FORMATTER_ENTRY_POINT):
+        yield name, formatter
 
 
 def find_plugin_styles():
-    if pkg_resources is None:
-        return
-    for entrypoint in pkg_resources.iter_entry_points(STYLE_ENTRY_POINT):
-        yield entrypoint.name, entrypoint.load()
+    for name, style in _load_entrypoints(STYLE_ENTRY_POINT):
+        yield name, style
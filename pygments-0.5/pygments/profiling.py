@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+    pygments.profiling
+    ~~~~~~~~~~~~~~~~~~
+
+    Per-rule profiling of `RegexLexer` subclasses.
+
+    Profiling replaces the rule table of a lexer class with one in which
+    every regex counts its calls, so the lexing loop itself is the same
+    with and without profiling.
+
+    :copyright: 2006 by Georg Brandl.
+    :license: GNU LGPL, see LICENSE for more details.
+"""
+from timeit import default_timer
+
+
+__all__ = ['RuleProfile', 'enable_profiling', 'disable_profiling',
+           'profile_lexer']
+
+#: Number of rules in each ranking of `RuleProfile.format_report`
+REPORT_SIZE = 15
+
+
+class _ProfiledRegex(object):
+    """
+    Stands in for the compiled regex of a rule and adds its attempts,
+    matches and the time spent matching to the list ``stats``.
+    """
+
+    def __init__(self, rex, stats):
+        self.rex = rex
+        self.pattern = rex.pattern
+        self.groups = rex.groups
+        self.stats = stats
+
+    def match(self, *args):
+        stats = self.stats
+        start = default_timer()
+        m = self.rex.match(*args)
+        stats[2] += default_timer() - start
+        stats[0] += 1
+        if m is not None:
+            stats[1] += 1
+        return m
+
+
+class _Fallback(object):
+    """
+    Follows the rules of a state and never matches, so it is only tried
+    when all rules failed. Counts the error tokens and line ends that
+    the lexer yields then in the list ``counts``.
+    """
+
+    pattern = ''
+    groups = 0
+
+    def __init__(self, counts):
+        self.counts = counts
+
+    def match(self, text, pos, end=None):
+        if end is None:
+            end = len(text)
+        if pos < end:
+            if text[pos] == '\n':
+                self.counts[1] += 1
+            else:
+                self.counts[0] += 1
+        return None
+
+
+class RuleProfile(object):
+    """
+    The statistics of the rules of a lexer class while profiling is
+    enabled for it.
+    """
+
+    def __init__(self, lexercls):
+        self.lexercls = lexercls
+        #: Maps ``(state, rule index)`` to ``[attempts, matches, seconds]``
+        self.rules = {}
+        #: Maps ``(state, rule index)`` to the regex of the rule
+        self.patterns = {}
+        #: Maps states to ``[error tokens, line ends]``, counted when none
+        #: of the rules of the state matched
+        self.fallbacks = {}
+        self._saved_tokens = lexercls.__dict__.get('_tokens')
+        self._tokens = {}
+        for state, tokens in lexercls._tokens.iteritems():
+            self._tokens[state] = self._profile_state(state, tokens)
+
+    def _profile_state(self, state, tokens):
+        result = []
+        for rex, action, new_state in tokens:
+            if action is None:
+                # merged rules are profiled one by one
+                for i in xrange(len(new_state)):
+                    result.append(new_state['_%d' % i])
+            else:
+                result.append((rex, action, new_state))
+        for index, (rex, action, new_state) in enumerate(result):
+            stats = self.rules[state, index] = [0, 0, 0.0]
+            self.patterns[state, index] = rex.pattern
+            result[index] = (_ProfiledRegex(rex, stats), action, new_state)
+        counts = self.fallbacks[state] = [0, 0]
+        result.append((_Fallback(counts), None, None))
+        return result
+
+    def get_hottest_rules(self, n=REPORT_SIZE):
+        """
+        Return the ``(state, rule index)`` keys of the ``n`` rules that
+        took the most time, slowest first.
+        """
+        items = [(-stats[2], key) for key, stats in self.rules.iteritems()
+                 if stats[0]]
+        items.sort()
+        return [key for secs, key in items[:n]]
+
+    def get_unproductive_rules(self, n=REPORT_SIZE):
+        """
+        Return the keys of the ``n`` rules that failed to match most
+        often, most failures first.
+        """
+        items = [(stats[1] - stats[0], key)
+                 for key, stats in self.rules.iteritems()
+                 if stats[0] != stats[1]]
+        items.sort()
+        return [key for failures, key in items[:n]]
+
+    def format_report(self, n=REPORT_SIZE):
+        """
+        Return a text report with the ``n`` hottest rules, the ``n`` rules
+        that are tried most but rarely match and the fallbacks per state.
+        """
+        lines = ['Rule profile of %s' % self.lexercls.__name__, '']
+        header = '%-20s %5s %10s %10s %7s %9s  %s' % (
+            'state', 'rule', 'attempts', 'matches', 'match%', 'msecs',
+            'regex')
+        for title, keys in (('Hottest rules', self.get_hottest_rules(n)),
+                            ('Rules tried most but matching least',
+                             self.get_unproductive_rules(n))):
+            lines += [title + ':', header, '-' * 79]
+            for key in keys:
+                attempts, matches, secs = self.rules[key]
+                lines.append('%-20s %5d %10d %10d %6.1f%% %9.2f  %s' % (
+                    key[0][:20], key[1], attempts, matches,
+                    100.0 * matches / attempts, secs * 1000,
+                    repr(self.patterns[key])[:40]))
+            lines.append('')
+        lines += ['Fallbacks:', '%-20s %10s %10s' % ('state', 'errors',
+                                                     'line ends'), '-' * 42]
+        states = [state for state in self.fallbacks
+                  if self.fallbacks[state] != [0, 0]]
+        states.sort()
+        for state in states:
+            lines.append('%-20s %10d %10d' % ((state[:20],) +
+                                              tuple(self.fallbacks[state])))
+        return '\n'.join(lines) + '\n'
+
+
+def enable_profiling(lexercls):
+    """
+    Start profiling the rules of the `RegexLexer` subclass ``lexercls``
+    and return the `RuleProfile` that collects the statistics. Lexers
+    of the class that are already lexing keep their current state's
+    rules until they change the state.
+    """
+    if '_profile' in lexercls.__dict__:
+        return lexercls._profile
+    lexercls._process_tokens()
+    profile = RuleProfile(lexercls)
+    lexercls._tokens = profile._tokens
+    lexercls._profile = profile
+    return profile
+
+
+def disable_profiling(lexercls):
+    """
+    Stop profiling ``lexercls`` and return its `RuleProfile`, or None if
+    it wasn't profiled.
+    """
+    profile = lexercls.__dict__.get('_profile')
+    if profile is None:
+        return None
+    del lexercls._profile
+    if profile._saved_tokens is None:
+        # the table was inherited
+        del lexercls._tokens
+    else:
+        lexercls._tokens = profile._saved_tokens
+    return profile
+
+
+def profile_lexer(lexer, text):
+    """
+    Lex ``text`` with the `RegexLexer` instance ``lexer`` with profiling
+    enabled and return the `RuleProfile`. Other lexers that ``lexer``
+    delegates to are not profiled.
+    """
+    cls = lexer.__class__
+    # if the caller enabled profiling, it also stops it
+    enabled = '_profile' in cls.__dict__
+    profile = enable_profiling(cls)
+    try:
+        for item in lexer.get_tokens(text):
+            pass
+    finally:
+        if not enabled:
+            disable_profiling(cls)
+    return profile
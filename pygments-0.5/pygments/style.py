@@ -12,6 +12,22 @@
 from pygments.token import Token, STANDARD_TYPES
 
 
+class _StyleDict(dict):
+    """
+    The style of a token type. It is shared by all users of the style,
+    so it can't be modified.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('token styles are read-only')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _readonly
+
+    def copy(self):
+        return dict(self)
+
+
 class StyleMeta(type):
 
     def __new__(mcs, name, bases, dct):
@@ -68,25 +84,39 @@ class StyleMeta(type):
                     else:
                         ndef[0] = colorformat(styledef)
 
+        # the resolved styles are shared, so nothing builds them again
+        obj._style_dicts = {}
+        for token, ndef in _styles.iteritems():
+            obj._style_dicts[token] = _StyleDict({
+                'color':        ndef[0] or None,
+                'bold':         bool(ndef[1]),
+                'italic':       bool(ndef[2]),
+                'underline':    bool(ndef[3]),
+                'bgcolor':      ndef[4] or None,
+                'border':       ndef[5] or None
+            })
+            _styles[token] = tuple(ndef)
+        #: tables that formatters build from the style, see
+        #: `Formatter._get_style_tables`
+        obj._formatter_cache = {}
+
         return obj
 
     def style_for_token(cls, token):
-        t = cls._styles[token]
-        return {
-            'color':        t[0] or None,
-            'bold':         bool(t[1]),
-            'italic':       bool(t[2]),
-            'underline':    bool(t[3]),
-            'bgcolor':      t[4] or None,
-            'border':       t[5] or None
-        }
+        """
+        Return the style of ``token`` as a dict. The dict is shared and
+        read-only, use its ``copy()`` method to get one that can be
+        changed.
+        """
+        return cls._style_dicts[token]
 
     def list_styles(cls):
         return list(cls)
 
     def __iter__(cls):
+        style_dicts = cls._style_dicts
         for token in cls._styles:
-            yield token, cls.style_for_token(token)
+            yield token, style_dicts[token]
 
     def __len__(cls):
         return len(cls._styles)
@@ -11,6 +11,8 @@
 
 class _TokenType(tuple):
     parent = None
+    #: Index of the token type in `TOKEN_TYPES`
+    id = 0
 
     def split(self):
         buf = []
@@ -27,17 +29,20 @@ class _TokenType(tuple):
         new = _TokenType(self + (val,))
         setattr(self, val, new)
         new.parent = self
+        new.id = len(TOKEN_TYPES)
+        TOKEN_TYPES.append(new)
         return new
 
-    def __hash__(self):
-        return hash(tuple(self))
-
     def __repr__(self):
         return 'Token' + (self and '.' or '') + '.'.join(self)
 
 
 Token     = _TokenType()
 
+#: All token types created so far, in order of creation. Parent types
+#: come before their subtypes.
+TOKEN_TYPES = [Token]
+
 # Special token types
 Text      = Token.Text
 Error     = Token.Error
@@ -66,6 +71,37 @@ def is_token_subtype(ttype, other):
     return False
 
 
+def extend_type_table(table, mapping):
+    """
+    Extend the list ``table`` so that ``table[ttype.id]`` exists for all
+    token types created so far. The item for a token type is its value
+    in ``mapping``, or that of its parent if it has none there (None for
+    `Token`).
+
+    The new items are built first and stored with one slice assignment,
+    so tables shared between threads always line up with the token type
+    ids, even if several threads extend them at the same time.
+    """
+    start = len(table)
+    new = []
+    for ttype in TOKEN_TYPES[start:]:
+        if ttype in mapping:
+            new.append(mapping[ttype])
+        elif ttype.parent is None:
+            new.append(None)
+        else:
+            pid = ttype.parent.id
+            if pid < start:
+                new.append(table[pid])
+            else:
+                new.append(new[pid - start])
+    # the items only depend on the token type, so overwriting items that
+    # another thread added in the meantime changes nothing, and the table
+    # never gets shorter
+    table[start:start + len(new)] = new
+    return table
+
+
 # Map standard token types to short names, used in CSS class naming.
 # If you add a new item, please be sure to run this file to perform
 # a consistency check for duplicate values.
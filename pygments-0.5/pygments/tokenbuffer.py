@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+    pygments.tokenbuffer
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Compact storage for token streams.
+
+    :copyright: 2006 by Georg Brandl.
+    :license: GNU LGPL, see LICENSE for more details.
+"""
+import sys
+from array import array
+
+
+__all__ = ['TokenBuffer']
+
+#: Size of a character of a unicode string in bytes
+UNICODE_CHARSIZE = sys.maxunicode > 0xffff and 4 or 2
+
+
+class TokenBuffer(object):
+    """
+    Holds a token stream in a compact form: the token types as indexes
+    into a table of the types in the stream, the token positions in an
+    array and the token values as one string that they are slices of.
+
+    Iterating over a buffer yields the ``(tokentype, value)`` pairs of
+    the stream, so it can be given to formatters instead of the stream.
+    """
+
+    def __init__(self, tokens=()):
+        #: The token types in the buffer, in order of appearance
+        self.ttypes = ttypes = []
+        ids = {}
+        self._types = types = array('H')
+        #: Start offsets of the tokens in `text`, and the end of the text
+        self.offsets = offsets = array('I', [0])
+        add_type = types.append
+        add_offset = offsets.append
+        parts = []
+        values = []
+        add_value = values.append
+        pos = 0
+        for ttype, value in tokens:
+            try:
+                add_type(ids[ttype])
+            except KeyError:
+                ids[ttype] = len(ttypes)
+                add_type(len(ttypes))
+                ttypes.append(ttype)
+            pos += len(value)
+            add_offset(pos)
+            add_value(value)
+            if len(values) == 1024:
+                # join early, so that the token values can be freed
+                parts.append(''.join(values))
+                del values[:]
+        parts.append(''.join(values))
+        #: The token values joined
+        self.text = ''.join(parts)
+
+    def __len__(self):
+        return len(self._types)
+
+    def __iter__(self):
+        ttypes = self.ttypes
+        offsets = self.offsets
+        text = self.text
+        start = 0
+        i = 1
+        for tid in self._types:
+            end = offsets[i]
+            yield ttypes[tid], text[start:end]
+            start = end
+            i += 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self._types)
+        ttype = self.ttypes[self._types[index]]
+        return ttype, self.text[self.offsets[index]:self.offsets[index+1]]
+
+    def get_tokens_unprocessed(self):
+        """
+        Yield ``(index, tokentype, value)`` tuples like the method of
+        lexers, with ``index`` being the offset of the token in `text`.
+        """
+        ttypes = self.ttypes
+        offsets = self.offsets
+        text = self.text
+        start = 0
+        i = 1
+        for tid in self._types:
+            end = offsets[i]
+            yield start, ttypes[tid], text[start:end]
+            start = end
+            i += 1
+
+    def get_size(self):
+        """Return the approximate memory use of the buffer in bytes."""
+        charsize = isinstance(self.text, unicode) and UNICODE_CHARSIZE or 1
+        return (len(self.text) * charsize +
+                len(self._types) * self._types.itemsize +
+                len(self.offsets) * self.offsets.itemsize +
+                len(self.ttypes) * 8)
@@ -10,6 +10,11 @@
 """
 import re
 
+try:
+    frozenset
+except NameError:
+    from sets import ImmutableSet as frozenset
+
 
 split_path_re = re.compile(r'[/\\ ]')
 doctype_lookup_re = re.compile(r'''(?smx)
@@ -20,7 +25,26 @@ doctype_lookup_re = re.compile(r'''(?smx)
      "[^"]*")
      [^>]+>
 ''')
-tag_re = re.compile(r'<(.+?)(\s.*?)?>.*?</\1>(?uism)')
+closing_tag_re = re.compile(r'</([^\s>]+)>')
+emacs_modeline_re = re.compile(r'-\*-\s*(.*?)\s*-\*-')
+vim_modeline_re = re.compile(r'''(?mx)
+    (?:^|\s)(?:vi|vim|ex)(?:[<=>]?\d*)?:
+    (?:.*?[:\s])?(?:ft|filetype|syn|syntax)=([\w+\#.-]+)
+''')
+
+#: ``(text, result)`` of the last call of `get_shebang_interpreter`,
+#: `_match_doctype` and `looks_like_xml`. The analysers run by a lexer
+#: guess all look at the same text object, so it is only examined once.
+#: Only texts up to `_MAX_CACHED_TEXT` characters (like the prefix that
+#: `guess_lexer` analyses) are kept, so that no large document is kept
+#: alive by the caches.
+_MAX_CACHED_TEXT = 8192
+_shebang_cache = (None, None)
+_doctype_cache = (None, None)
+_xml_cache = (None, None)
+
+#: Sets built by `get_builtin_names`, by module name and disabled modules
+_builtin_names_cache = {}
 
 
 class OptionError(Exception):
@@ -63,6 +87,27 @@ def get_list_opt(options, optname, default=None):
                           val, optname)
 
 
+def get_builtin_names(module_name, disabled_modules=()):
+    """
+    Return a frozenset of the names in the ``MODULES`` dict of the module
+    ``module_name``, leaving out the lists for the keys in
+    ``disabled_modules``. The set is only built once and is shared by
+    all lexers that ask for the same names.
+    """
+    disabled = list(disabled_modules)
+    disabled.sort()
+    key = (module_name, tuple(disabled))
+    names = _builtin_names_cache.get(key)
+    if names is None:
+        modules = __import__(module_name, None, None, ['MODULES']).MODULES
+        names = []
+        for module, functions in modules.iteritems():
+            if module not in disabled:
+                names.extend(functions)
+        names = _builtin_names_cache[key] = frozenset(names)
+    return names
+
+
 def make_analysator(f):
     """
     Return a static text analysation function that
@@ -106,30 +151,94 @@ def shebang_matches(text, regex):
     Note that this method automatically searches the whole string (eg:
     the regular expression is wrapped in ``'^$'``)
     """
-    index = text.find('\n')
-    if index >= 0:
-        first_line = text[:index].lower()
-    else:
-        first_line = text.lower()
-    if first_line.startswith('#!'):
-        try:
-            found = [x for x in split_path_re.split(first_line[2:].strip())
-                     if x and not x.startswith('-')][-1]
-        except IndexError:
-            return False
+    found = get_shebang_interpreter(text)
+    if found is not None:
         regex = re.compile('^%s(\.(exe|cmd|bat|bin))?$' % regex, re.IGNORECASE)
         if regex.search(found) is not None:
             return True
     return False
 
 
+def get_shebang_interpreter(text):
+    """
+    Return the last part of the shebang (lowercased and without
+    parameters) or None if the text has no shebang.
+
+        >>> from pygments.util import get_shebang_interpreter
+        >>> get_shebang_interpreter('#!/usr/bin/env python2.4 -O')
+        'python2.4'
+    """
+    global _shebang_cache
+    cache = _shebang_cache
+    if cache[0] is text:
+        return cache[1]
+    found = None
+    if text[:2] == '#!':
+        index = text.find('\n')
+        if index >= 0:
+            first_line = text[2:index].lower()
+        else:
+            first_line = text[2:].lower()
+        parts = [x for x in split_path_re.split(first_line.strip())
+                 if x and not x.startswith('-')]
+        if parts:
+            found = parts[-1]
+    if len(text) <= _MAX_CACHED_TEXT:
+        _shebang_cache = (text, found)
+    return found
+
+
+def get_modeline_mode(text):
+    """
+    Return the mode named by an Emacs (``-*- mode: python -*-``) or Vim
+    (``vim: ft=python``) modeline, or None if there is none. Like the
+    editors, only the first lines (and the last ones for Vim) are
+    looked at.
+
+        >>> from pygments.util import get_modeline_mode
+        >>> get_modeline_mode('#!/bin/sh\\n# -*- mode: Ruby; coding: utf-8 -*-')
+        'ruby'
+    """
+    head = text[:4096].splitlines()
+    m = emacs_modeline_re.search('\n'.join(head[:2]))
+    if m is not None:
+        content = m.group(1)
+        if ':' not in content:
+            return content.lower() or None
+        for part in content.split(';'):
+            if ':' in part:
+                key, value = part.split(':', 1)
+                if key.strip().lower() == 'mode':
+                    return value.strip().lower() or None
+    lines = head[:5]
+    if len(text) > 4096:
+        lines += text[-4096:].splitlines()[-5:]
+    else:
+        lines += head[5:][-5:]
+    m = vim_modeline_re.search('\n'.join(lines))
+    if m is not None:
+        return m.group(1).lower()
+    return None
+
+
+def _match_doctype(text):
+    global _doctype_cache
+    cache = _doctype_cache
+    if cache[0] is text:
+        return cache[1]
+    m = doctype_lookup_re.match(text)
+    if len(text) <= _MAX_CACHED_TEXT:
+        _doctype_cache = (text, m)
+    return m
+
+
 def doctype_matches(text, regex):
     """
     Check if the doctype matches a regular expression (if present).
     Note that this method only checks the first part of a DOCTYPE.
     eg: 'html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN"'
     """
-    m = doctype_lookup_re.match(text)
+    m = _match_doctype(text)
     if m is None:
         return False
     doctype = m.group(2)
@@ -147,7 +256,31 @@ def looks_like_xml(text):
     """
     Check if a doctype exists or if we have some tags
     """
-    m = doctype_lookup_re.match(text)
-    if m is not None:
-        return True
-    return tag_re.search(text) is not None
+    global _xml_cache
+    cache = _xml_cache
+    if cache[0] is text:
+        return cache[1]
+    rv = _match_doctype(text) is not None or _has_tag_pair(text)
+    if len(text) <= _MAX_CACHED_TEXT:
+        _xml_cache = (text, rv)
+    return rv
+
+
+def _has_tag_pair(text):
+    """
+    Check if there is a closing tag with a matching opening tag before
+    it. The text before each closing tag is only searched once per tag
+    name, so this stays linear for long texts.
+    """
+    checked = {}
+    for m in closing_tag_re.finditer(text):
+        name = m.group(1).lower()
+        if name in checked:
+            opening_re, pos = checked[name]
+        else:
+            opening_re = re.compile(r'<%s[\s>]' % re.escape(name), re.I)
+            pos = 0
+        if opening_re.search(text, pos, m.start()) is not None:
+            return True
+        checked[name] = (opening_re, m.start())
+    return False
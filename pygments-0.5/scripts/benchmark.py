@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Pygments benchmarks
+    ~~~~~~~~~~~~~~~~~~~
+
+    Measure the performance of Pygments.
+
+    Usage::
+
+        python scripts/benchmark.py [-b <benchmark>] [-n <repeat>]
+                                    [-o <result.json>] [-c <baseline.json>]
+                                    [-t <percent>] [<examplefile> ...]
+
+    Benchmarks:
+
+    ``lexing`` (default)
+        Lex the files in ``tests/examplefiles`` once with merged states
+        and once with ``RegexLexer.merge_states`` switched off, so that
+        the gain of the single-regex dispatch can be seen.
+
+    ``formatting``
+        Format the tokens of the files with the `HtmlFormatter`, once
+        with CSS classes and once with inline styles.
+
+    ``sublexers``
+        Lex the example files that delegate to other lexers with
+        `using()` (by default ``smarty_example.html`` and
+        ``genshi_example.xml+genshi``), once with a new lexer for every
+        run and once with the same lexer for all runs.
+
+    ``startup``
+        Time ``import pygments`` and highlighting one line, each in a
+        fresh interpreter, against an interpreter that does nothing.
+
+    ``corpus``
+        Lex every file and report bytes/s, tokens/s and the peak memory
+        of lexing (measured in a forked process, where available), then
+        time each of the formatters in `CORPUS_FORMATTERS` on the tokens.
+
+    The ``corpus`` results can be written as JSON with ``-o``. With
+    ``-c``, they are compared against such a file, and every time or
+    memory use that grew by more than ``-t`` percent (default: 10) is
+    reported as a regression; the exit status is 1 if there are any.
+    Times below a millisecond and memory uses below a megabyte are too
+    noisy to compare per file, they only count in the totals.
+
+    :copyright: 2006 by Georg Brandl.
+    :license: GNU GPL, see LICENSE for more details.
+"""
+
+import sys, os
+import time
+import getopt
+import subprocess
+try:
+    import json
+except ImportError:
+    import simplejson as json
+from StringIO import StringIO
+from os.path import join, dirname, abspath, isfile
+
+rootdir = abspath(join(dirname(__file__), '..'))
+sys.path.insert(0, rootdir)
+
+from pygments.lexer import RegexLexer
+from pygments.lexers import get_lexer_for_filename, get_lexer_by_name
+from pygments.formatters import HtmlFormatter, get_formatter_by_name
+
+
+exampledir = join(rootdir, 'tests', 'examplefiles')
+
+SUBLEXER_FILES = ['smarty_example.html', 'genshi_example.xml+genshi']
+
+#: Formatters timed by the ``corpus`` benchmark
+CORPUS_FORMATTERS = ['html', 'latex', 'terminal', 'raw', 'bbcode']
+
+#: Per-file times (in seconds) and memory uses (in KB) below these are
+#: not compared with the baseline
+MIN_COMPARED_TIME = 0.001
+MIN_COMPARED_MEMORY = 1024
+
+STARTUP_COMMANDS = [
+    ('python -c pass', 'pass'),
+    ('import pygments', 'import pygments'),
+    ('one-line highlight',
+     'from pygments import highlight\n'
+     'from pygments.lexers import get_lexer_by_name\n'
+     'from pygments.formatters import get_formatter_by_name\n'
+     'highlight("print 42", get_lexer_by_name("python"), '
+     'get_formatter_by_name("html"))'),
+]
+
+
+def get_examplefiles(names=None):
+    """Return a sorted list of ``(filename, text)`` pairs."""
+    if not names:
+        names = [fn for fn in os.listdir(exampledir)
+                 if isfile(join(exampledir, fn))]
+        names.sort()
+    result = []
+    for fn in names:
+        f = file(join(exampledir, fn), 'U')
+        try:
+            result.append((fn, f.read()))
+        finally:
+            f.close()
+    return result
+
+
+def get_lexer_class(fn):
+    """Return the lexer class for an example file."""
+    try:
+        return get_lexer_for_filename(fn).__class__
+    except ValueError:
+        return get_lexer_by_name(fn.split('_', 1)[0]).__class__
+
+
+def reset_lexer_classes(classes):
+    """Forget the processed token definitions of the given classes."""
+    for cls in classes:
+        for klass in cls.__mro__:
+            if '_tokens' in klass.__dict__:
+                del klass._tokens
+
+
+def time_lexing(files, repeat):
+    """Lex every file ``repeat`` times and return ``{fn: (secs, ntokens)}``."""
+    result = {}
+    for fn, text in files:
+        lexer = get_lexer_class(fn)()
+        # warm up, this also compiles the state regexes
+        list(lexer.get_tokens(text))
+        best = None
+        for i in xrange(repeat):
+            start = time.time()
+            ntokens = len(list(lexer.get_tokens(text)))
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        result[fn] = (best, ntokens)
+    return result
+
+
+def bench_merged_states(files, repeat):
+    classes = [get_lexer_class(fn) for fn, text in files]
+
+    reset_lexer_classes(classes)
+    RegexLexer.merge_states = False
+    try:
+        plain = time_lexing(files, repeat)
+    finally:
+        RegexLexer.merge_states = True
+        reset_lexer_classes(classes)
+    merged = time_lexing(files, repeat)
+
+    print '%-32s %10s %12s %12s %7s' % ('file', 'tokens', 'per-rule/s',
+                                         'merged/s', 'gain')
+    print '-' * 77
+    total_plain = total_merged = total_tokens = 0
+    for fn, text in files:
+        ptime, ntokens = plain[fn]
+        mtime = merged[fn][0]
+        total_plain += ptime
+        total_merged += mtime
+        total_tokens += ntokens
+        print '%-32s %10d %12d %12d %6.2fx' % (fn[:32], ntokens,
+              ntokens / ptime, ntokens / mtime, ptime / mtime)
+    print '-' * 77
+    print '%-32s %10d %12d %12d %6.2fx' % ('total', total_tokens,
+          total_tokens / total_plain, total_tokens / total_merged,
+          total_plain / total_merged)
+
+
+def bench_sublexers(files, repeat):
+    print '%-32s %10s %12s %12s' % ('file', 'tokens', 'new lexer/s',
+                                    'same lexer/s')
+    print '-' * 69
+    for fn, text in files:
+        cls = get_lexer_class(fn)
+        ntokens = len(list(cls().get_tokens(text)))
+        times = []
+        for make_lexer in (cls, lambda lexer=cls(): lexer):
+            best = None
+            for i in xrange(repeat):
+                start = time.time()
+                for j in xrange(10):
+                    list(make_lexer().get_tokens(text))
+                elapsed = (time.time() - start) / 10
+                if best is None or elapsed < best:
+                    best = elapsed
+            times.append(best)
+        print '%-32s %10d %12d %12d' % (fn[:32], ntokens,
+              ntokens / times[0], ntokens / times[1])
+
+
+def time_formatting(formatter, tokens, repeat):
+    """Return the best time of formatting ``tokens`` with ``formatter``."""
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        formatter.format(tokens, StringIO())
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_formatting(files, repeat):
+    print '%-32s %10s %12s %12s' % ('file', 'tokens', 'classes/s',
+                                    'inline/s')
+    print '-' * 69
+    total_classes = total_inline = total_tokens = 0
+    for fn, text in files:
+        tokens = list(get_lexer_class(fn)().get_tokens(text))
+        ctime = time_formatting(HtmlFormatter(), tokens, repeat)
+        itime = time_formatting(HtmlFormatter(noclasses=True), tokens,
+                                repeat)
+        total_classes += ctime
+        total_inline += itime
+        total_tokens += len(tokens)
+        print '%-32s %10d %12d %12d' % (fn[:32], len(tokens),
+              len(tokens) / ctime, len(tokens) / itime)
+    print '-' * 69
+    print '%-32s %10d %12d %12d' % ('total', total_tokens,
+          total_tokens / total_classes, total_tokens / total_inline)
+
+
+def time_command(code, repeat):
+    """Return the best time of running ``code`` in a new interpreter."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = rootdir
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        subprocess.call([sys.executable, '-c', code], env=env)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_startup(files, repeat):
+    print '%-32s %10s %10s' % ('command', 'msecs', 'pygments')
+    print '-' * 54
+    base = None
+    for name, code in STARTUP_COMMANDS:
+        elapsed = time_command(code, repeat)
+        if base is None:
+            base = elapsed
+        print '%-32s %10.1f %10.1f' % (name, elapsed * 1000,
+                                       (elapsed - base) * 1000)
+
+
+def best_time(func, repeat):
+    """Return the best time of ``repeat`` calls of ``func``."""
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def get_peak_memory(func):
+    """
+    Return the growth of the peak memory use in KB while ``func`` runs in
+    a forked process, or None if that can't be measured here.
+    """
+    if not hasattr(os, 'fork') or not hasattr(os, 'wait4'):
+        return None
+    def child_maxrss(func):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                func()
+            finally:
+                os._exit(0)
+        return os.wait4(pid, 0)[2].ru_maxrss
+    # the peak of a child starts at the memory use of this process
+    base = child_maxrss(lambda: None)
+    peak = child_maxrss(func)
+    if sys.platform == 'darwin':
+        # reported in bytes there
+        return max(peak - base, 0) // 1024
+    return max(peak - base, 0)
+
+
+def bench_corpus(files, repeat):
+    results = {}
+    total = {'bytes': 0, 'tokens': 0, 'lexing': 0.0, 'peak_memory': 0}
+    for name in CORPUS_FORMATTERS:
+        total[name] = 0.0
+    print '%-32s %10s %10s %11s %8s' % ('file', 'bytes/s', 'tokens/s',
+                                        'peak KB', 'lexing'),
+    for name in CORPUS_FORMATTERS:
+        print '%8s' % name[:8],
+    print
+    print '-' * (75 + 9 * len(CORPUS_FORMATTERS))
+    for fn, text in files:
+        lexer = get_lexer_class(fn)()
+        tokens = list(lexer.get_tokens(text))
+        result = {
+            'bytes':        len(text),
+            'tokens':       len(tokens),
+            'lexing':       best_time(lambda: list(lexer.get_tokens(text)),
+                                      repeat),
+            'peak_memory':  get_peak_memory(
+                lambda: list(lexer.get_tokens(text))),
+        }
+        for name in CORPUS_FORMATTERS:
+            formatter = get_formatter_by_name(name)
+            result[name] = best_time(
+                lambda: formatter.format(tokens, StringIO()), repeat)
+        results[fn] = result
+        for key in total:
+            if result[key] is not None:
+                total[key] += result[key]
+        print_corpus_line(fn, result)
+    print '-' * (75 + 9 * len(CORPUS_FORMATTERS))
+    print_corpus_line('total', total)
+    return {'python': sys.version.split()[0], 'repeat': repeat,
+            'files': results, 'total': total}
+
+
+def print_corpus_line(fn, result):
+    peak = result['peak_memory']
+    if peak is None:
+        peak = '-'
+    print '%-32s %10d %10d %11s %8.4f' % (fn[:32],
+          result['bytes'] / result['lexing'],
+          result['tokens'] / result['lexing'], peak, result['lexing']),
+    for name in CORPUS_FORMATTERS:
+        print '%8.4f' % result[name],
+    print
+
+
+def compare_results(results, baseline, threshold):
+    """
+    Print the measurements in ``results`` that grew by more than
+    ``threshold`` percent from ``baseline`` and return their number.
+    """
+    keys = ['lexing', 'peak_memory'] + CORPUS_FORMATTERS
+    limit = 1 + threshold / 100.0
+    regressions = []
+    def compare(fn, new, old):
+        for key in keys:
+            if new.get(key) is None or not old.get(key):
+                continue
+            if fn != 'total':
+                if key == 'peak_memory':
+                    if old[key] < MIN_COMPARED_MEMORY:
+                        continue
+                elif old[key] < MIN_COMPARED_TIME:
+                    continue
+            if new[key] > old[key] * limit:
+                regressions.append((fn, key, old[key], new[key]))
+    for fn, new in sorted(results['files'].items()):
+        if fn in baseline['files']:
+            compare(fn, new, baseline['files'][fn])
+    # totals are only comparable over the same files
+    if sorted(results['files']) == sorted(baseline['files']):
+        compare('total', results['total'], baseline['total'])
+    if not regressions:
+        print
+        print 'no regressions of more than %g%%' % threshold
+        return 0
+    print
+    print '%-32s %12s %12s %12s %7s' % ('regression', 'measure', 'baseline',
+                                        'now', 'change')
+    print '-' * 79
+    for fn, key, old, new in regressions:
+        print '%-32s %12s %12.4f %12.4f %+6.1f%%' % (fn[:32], key, old, new,
+              (new / float(old) - 1) * 100)
+    return len(regressions)
+
+
+BENCHMARKS = {
+    'lexing':       bench_merged_states,
+    'formatting':   bench_formatting,
+    'sublexers':    bench_sublexers,
+    'startup':      bench_startup,
+    'corpus':       bench_corpus,
+}
+
+
+def main(args):
+    try:
+        opts, args = getopt.getopt(args[1:], 'b:n:o:c:t:')
+    except getopt.GetoptError:
+        print >>sys.stderr, __doc__
+        return 2
+    opts = dict(opts)
+    bench = BENCHMARKS.get(opts.get('-b', 'lexing'))
+    if bench is None:
+        print >>sys.stderr, __doc__
+        return 2
+    if ('-o' in opts or '-c' in opts) and bench is not bench_corpus:
+        print >>sys.stderr, 'only the corpus benchmark has JSON results'
+        return 2
+    repeat = int(opts.get('-n', 3))
+    files = []
+    if bench is bench_sublexers:
+        files = get_examplefiles(args or SUBLEXER_FILES)
+    elif bench is not bench_startup:
+        files = get_examplefiles(args)
+    results = bench(files, repeat)
+    if '-o' in opts:
+        f = file(opts['-o'], 'w')
+        try:
+            json.dump(results, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+    if '-c' in opts:
+        f = file(opts['-c'])
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        if compare_results(results, baseline, float(opts.get('-t', 10))):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
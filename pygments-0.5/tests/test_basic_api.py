@@ -7,12 +7,23 @@
     :license: GNU GPL, see LICENSE for more details.
 """
 
+import os
+import sys
+import mmap
+import shutil
+import tempfile
 import unittest
 import StringIO
 import random
 
-from pygments import lexers, formatters
-from pygments.token import _TokenType
+import pygments
+from pygments import lexers, formatters, plugin
+from pygments.cache import TokenCache
+from pygments.filter import Filter, coalesce_tokens
+from pygments.tokenbuffer import TokenBuffer
+from pygments.util import OptionError
+from pygments.token import Token, _TokenType, TOKEN_TYPES, \
+     extend_type_table
 
 test_content = [chr(i) for i in xrange(33, 128)] * 5
 random.shuffle(test_content)
@@ -56,6 +67,114 @@ class LexersTest(unittest.TestCase):
             a(isinstance(x, lexers.PythonLexer))
             ae(x.options["opt"], "val")
 
+    def test_filename_lookup(self):
+        ae = self.assertEquals
+        # exact names, simple extensions and real glob patterns
+        for fn, name in [('Makefile', 'Makefile'), ('/x/y.tar.py', 'Python'),
+                         ('a.c++', 'C++'), ('test.php4', 'PHP')]:
+            ae(lexers.get_lexer_for_filename(fn).name, name)
+        self.assertRaises(ValueError, lexers.get_lexer_for_filename, 'a.py~')
+
+    def test_get_tokens_stream(self):
+        ae = self.assertEquals
+        text = file(os.path.join(testdir, 'examplefiles', 'test.boo')).read()
+        text = text.replace('\n', '\r\n') + '\t\n\n'
+        for lexer in [lexers.PythonLexer(tabsize=4), lexers.TextLexer(),
+                      lexers.PythonLexer(stripall=True),
+                      lexers.RubyConsoleLexer(stripnl=False)]:
+            expected = list(lexer.get_tokens(text))
+            for chunksize in 1, 7, 256:
+                tokens = list(lexer.get_tokens_stream(
+                    StringIO.StringIO(text), chunksize))
+                ae(''.join([v for t, v in tokens]),
+                   ''.join([v for t, v in expected]))
+                if chunksize == 256 and lexer.name != 'Text only':
+                    ae(tokens, expected)
+
+    def test_mmap_input(self):
+        ae = self.assertEquals
+        fd, fn = tempfile.mkstemp()
+        try:
+            os.write(fd, '\n\ndef f(x):\n    return "%s" % x\n\n\n')
+            mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            for lexer in [lexers.PythonLexer(), lexers.PythonLexer(stripnl=False),
+                          lexers.PythonLexer(stripall=True, tabsize=4),
+                          lexers.RubyLexer(), lexers.TextLexer()]:
+                ae(list(lexer.get_tokens(mm)),
+                   list(lexer.get_tokens(mm[:])))
+            # lexed in place, without the stripped newlines
+            self.assert_(isinstance(lexers.PythonLexer()._get_buffer_view(mm),
+                                    buffer))
+            mm.close()
+        finally:
+            os.close(fd)
+            os.remove(fn)
+
+    def test_guess_lexer(self):
+        ae = self.assertEquals
+        # modelines and shebangs naming an alias, then text analysis
+        for text, name in [('# -*- mode: ruby -*-\nputs 1', 'Ruby'),
+                           ('int x;\n/* vim: set ft=cpp : */\n', 'C++'),
+                           ('#!/usr/bin/env lua5.1\nprint(1)', 'Lua'),
+                           ('#!C:\\Perl\\bin\\perl.exe -w\n', 'Perl'),
+                           ('#!/usr/bin/python2.4\n', 'Python'),
+                           ('<?php echo 1; ?>', 'PHP')]:
+            ae(lexers.guess_lexer(text).name, name)
+        # only the start of the text is analysed
+        text = ' ' * lexers._GUESS_PREFIX_SIZE + '<?php'
+        self.assertRaises(ValueError, lexers.guess_lexer, text)
+        self.assertRaises(ValueError, lexers.guess_lexer, '#!/bin/sh\n')
+        # long texts aren't kept alive by the analysis caches
+        from pygments import util
+        text = '#!/usr/bin/python\n' + 'x' * 20000
+        ae(lexers.guess_lexer(text).name, 'Python')
+        for cache in (util._shebang_cache, util._doctype_cache,
+                      util._xml_cache):
+            self.assert_(cache[0] is None or
+                         len(cache[0]) <= lexers._GUESS_PREFIX_SIZE)
+
+
+class TokenTest(unittest.TestCase):
+
+    def test_type_ids(self):
+        for i, ttype in enumerate(TOKEN_TYPES):
+            self.assertEquals(ttype.id, i)
+            if ttype.parent is not None:
+                self.assert_(ttype.parent.id < i)
+        self.assert_(TOKEN_TYPES[Token.Name.Test.Ids.id] is
+                     Token.Name.Test.Ids)
+
+    def test_extend_type_table(self):
+        table = extend_type_table([], {Token.Name: 'n'})
+        self.assertEquals(len(table), len(TOKEN_TYPES))
+        self.assertEquals(table[Token.id], None)
+        self.assertEquals(table[Token.Name.Builtin.id], 'n')
+        # types created later are added by extending the table again
+        ttype = Token.Name.Test.Table
+        extend_type_table(table, {Token.Name: 'n'})
+        self.assertEquals(table[ttype.id], 'n')
+
+    def test_extend_type_table_concurrently(self):
+        table = extend_type_table([], {Token.Name: 'n'})
+        ttypes = [Token.Name.Test.Race, Token.Name.Test.Race.Sub,
+                  Token.Test.Race]
+        class Mapping(dict):
+            # another thread extends the table while this one does
+            extending = False
+            def __contains__(self, ttype):
+                if not self.extending:
+                    self.extending = True
+                    extend_type_table(table, self)
+                    Token.Test.Race.Later
+                    extend_type_table(table, self)
+                return dict.__contains__(self, ttype)
+        extend_type_table(table, Mapping({Token.Name: 'n'}))
+        self.assertEquals(len(table), len(TOKEN_TYPES))
+        for ttype in ttypes[:2]:
+            self.assertEquals(table[ttype.id], 'n')
+        for ttype in ttypes[2], Token.Test.Race.Later:
+            self.assertEquals(table[ttype.id], None)
+
 
 class FormattersTest(unittest.TestCase):
 
@@ -86,3 +205,471 @@ class FormattersTest(unittest.TestCase):
         x = formatters.get_formatter_for_filename("a.html", opt="val")
         a(isinstance(x, formatters.HtmlFormatter))
         ae(x.options["opt"], "val")
+
+    def test_style_tables_shared(self):
+        from pygments.styles import get_style_by_name
+        style = get_style_by_name('default')
+        self.assert_(style.style_for_token(Token.Keyword) is
+                     dict(style)[Token.Keyword])
+        sdict = style.style_for_token(Token.Keyword)
+        self.assertRaises(TypeError, sdict.__setitem__, 'bold', False)
+        self.assertRaises(TypeError, sdict.update, {'bold': False})
+        self.assert_(sdict['bold'])
+        sdict = sdict.copy()
+        sdict['bold'] = False
+        self.assert_(style.style_for_token(Token.Keyword)['bold'])
+        fmt1 = formatters.HtmlFormatter()
+        fmt2 = formatters.HtmlFormatter(cssclass='x')
+        fmt3 = formatters.HtmlFormatter(classprefix='p_')
+        self.assert_(fmt1.ttype2class is fmt2.ttype2class)
+        self.assert_(fmt1._spans is fmt2._spans)
+        self.assert_(fmt1.ttype2class is not fmt3.ttype2class)
+        self.assertEquals(fmt3.ttype2class[Token.Keyword], 'p_k')
+        self.assert_(formatters.HtmlFormatter(noclasses=True)._spans
+                     is not fmt1._spans)
+        self.assert_(formatters.LatexFormatter().cmd2def is
+                     formatters.LatexFormatter().cmd2def)
+        self.assert_(formatters.LatexFormatter(style='colorful').cmd2def is
+                     not formatters.LatexFormatter().cmd2def)
+
+    def test_style_defs_memoized(self):
+        from pygments.styles import get_style_by_name
+        defs = formatters.HtmlFormatter().get_style_defs('.x')
+        self.assertEquals(formatters.HtmlFormatter(cssclass='y').
+                          get_style_defs('.x'), defs)
+        self.assertEquals(formatters.HtmlFormatter().get_style_defs('.y'),
+                          defs.replace('.x ', '.y '))
+        self.assertEquals(formatters.HtmlFormatter(nobackground=True).
+                          get_style_defs('.x'),
+                          defs[defs.index('\n') + 1:])
+        # the selectors aren't part of what is memoized
+        cache = get_style_by_name('default')._formatter_cache
+        size = len(cache)
+        for i in xrange(10):
+            formatters.HtmlFormatter().get_style_defs('.page%d' % i)
+        self.assertEquals(len(cache), size)
+        self.assertEquals(formatters.HtmlFormatter(classprefix='p_').
+                          get_style_defs('.x'),
+                          defs.replace('.x .', '.x .p_'))
+
+    def test_html_spans(self):
+        ts = [(Token.Keyword, 'if'), (Token.Text, ' '),
+              (Token.Name.Custom, 'a'), (Token.Name.Custom, '<\nb'),
+              (Token.Keyword, ''), (Token.Name.Custom, '&')]
+        fmt = formatters.HtmlFormatter(nowrap=True, classprefix='p_')
+        # same-class tokens share a span, which is reopened after newlines
+        self.assertEquals(pygments.format(ts, fmt),
+                          '<span class="p_k">if</span> '
+                          '<span class="p_n-Custom">a&lt;</span>\n'
+                          '<span class="p_n-Custom">b&amp;</span>')
+
+    def test_new_token_types(self):
+        # types created after the formatter take the style of their parent
+        fmt = formatters.BBCodeFormatter()
+        fmt.format([(Token.Text, 'a')], StringIO.StringIO())
+        ts = [(Token.Keyword.Test.New, 'if'), (Token.Keyword, 'else')]
+        self.assertEquals(pygments.format(ts, fmt),
+                          '[color=#AA22FF][b]ifelse[/b][/color]')
+        fmt = formatters.LatexFormatter()
+        out = pygments.format(ts, fmt)
+        cmd = fmt.ttype2cmd[Token.Keyword]
+        self.assert_('@%s[if]@%s[else]' % (cmd, cmd) in out)
+
+    def test_terminal_colors(self):
+        ts = [(Token.Keyword, 'if'), (Token.Text, ' '),
+              (Token.Keyword, 'a\n\nb')]
+        self.assertEquals(pygments.format(ts, formatters.TerminalFormatter()),
+                          '\x1b[34mif\x1b[39;49;00m \x1b[39;49;00m'
+                          '\x1b[34ma\x1b[39;49;00m'
+                          '\n\n\x1b[34mb\x1b[39;49;00m')
+        self.assertEquals(pygments.format(ts[:2], formatters.TerminalFormatter(
+            colors='256')), '\x1b[01;38;5;129mif\x1b[39;49;00m ')
+        self.assertEquals(pygments.format(ts[:2], formatters.TerminalFormatter(
+            colors='truecolor')), '\x1b[01;38;2;170;34;255mif\x1b[39;49;00m ')
+        self.assert_(formatters.TerminalFormatter()._escapes is
+                     formatters.TerminalFormatter()._escapes)
+        self.assert_(formatters.TerminalFormatter(colors=256)._escapes is
+                     formatters.TerminalFormatter(colors='256')._escapes)
+        self.assertRaises(OptionError, formatters.TerminalFormatter,
+                          colors='8')
+
+    def test_terminal_long_values_flow(self):
+        # the lines of long values are written out as they are colored
+        out = StringIO.StringIO()
+        def tokens():
+            yield Token.Keyword, 'x\n' * 10000 + 'y'
+            self.assert_(len(out.getvalue()) > 100000)
+        formatters.TerminalFormatter().format(tokens(), out)
+        self.assertEquals(out.getvalue(),
+                          '\x1b[34mx\x1b[39;49;00m\n' * 10000 +
+                          '\x1b[34my\x1b[39;49;00m')
+
+    def test_html_inline_linenos(self):
+        ts = [(Token.Keyword, 'if'), (Token.Text, '\n\n'),
+              (Token.Name, 'a\nb'), (Token.Text, '\n')]
+        out = pygments.format(ts, formatters.HtmlFormatter(
+            cssclass='', linenos='inline', linenostep=2))
+        self.assertEquals(out, '<div><pre>'
+                          '<span class="lineno">     </span>'
+                          '<span class="k">if</span>\n'
+                          '<span class="lineno">   2 </span>\n'
+                          '<span class="lineno">     </span>'
+                          '<span class="n">a</span>\n'
+                          '<span class="lineno">   4 </span>'
+                          '<span class="n">b</span>\n</pre></div>\n')
+
+    def test_html_inline_linenos_span_at_end(self):
+        # the last token (a preprocessor line) ends with the newline
+        code = 'int x;\n#include <x>\n'
+        inline = pygments.highlight(code, lexers.CLexer(),
+            formatters.HtmlFormatter(linenos='inline'))
+        table = pygments.highlight(code, lexers.CLexer(),
+            formatters.HtmlFormatter(linenos=True))
+        self.assertEquals(inline.count('class="lineno"'), 2)
+        table = table[table.index('<pre>') + 5:table.index('</pre>')]
+        self.assertEquals(len(table.split('\n')), 2)
+        self.assert_('<span class="cp"></span>' not in inline)
+
+    def test_html_output_flows(self):
+        out = StringIO.StringIO()
+        def tokens():
+            for i in xrange(2000):
+                yield Token.Name, 'x'
+                yield Token.Text, '\n'
+            # the output must not wait for the end of the token stream
+            self.assert_(len(out.getvalue()) > 1000)
+        for options in ({}, {'full': True}, {'linenos': 'inline'}):
+            formatters.HtmlFormatter(**options).format(tokens(), out)
+
+    def test_html_long_runs_flow(self):
+        # runs of tokens with the same span are written out at line ends
+        out = StringIO.StringIO()
+        def tokens():
+            for i in xrange(10000):
+                yield Token.Name, 'x<'
+                yield Token.Name, '\n'
+            self.assert_(len(out.getvalue()) > 100000)
+        formatters.HtmlFormatter(nowrap=True).format(tokens(), out)
+        self.assertEquals(out.getvalue(),
+                          '<span class="n">x&lt;</span>\n' * 10000)
+
+
+class FilterTest(unittest.TestCase):
+
+    def test_coalesce_tokens(self):
+        ts = [(Token.Error, 'a'), (Token.Error, 'b'), (Token.Text, ''),
+              (Token.Error, 'c'), (Token.Text, ' '), (Token.Error, '')]
+        self.assertEquals(list(coalesce_tokens(ts)),
+                          [(Token.Error, 'abc'), (Token.Text, ' ')])
+        # long runs are split, so that streams stay streams
+        ts = [(Token.Text, 'x' * 1000)] * 20 + [(Token.Text, '')]
+        self.assertEquals([len(v) for t, v in coalesce_tokens(ts)],
+                          [9000, 9000, 2000])
+
+    def test_lex_filters(self):
+        class UpperFilter(Filter):
+            def filter(self, lexer, stream):
+                for ttype, value in stream:
+                    yield ttype, value.upper()
+        class CountFilter(Filter):
+            def filter(self, lexer, stream):
+                tokens = list(stream)
+                yield Token.Text, str(len(tokens))
+        lx = lexers.get_lexer_by_name('text')
+        self.assertEquals(pygments.highlight('abc', lx,
+                          formatters.NullFormatter(), filters=[UpperFilter()]),
+                          'ABC\n')
+        # the filters get the coalesced stream
+        self.assertEquals(list(pygments.lex('a\nb\n', lx, filters=
+                                            [UpperFilter(), CountFilter()])),
+                          [(Token.Text, '1')])
+
+
+class TokenCacheTest(unittest.TestCase):
+
+    def test_memory(self):
+        cache = TokenCache(maxsize=1000)
+        lx = lexers.PythonLexer()
+        ts = cache.get_tokens("def f(): pass", lx)
+        self.assertEquals(list(ts), list(lx.get_tokens("def f(): pass")))
+        self.assert_(cache.get_tokens("def f(): pass", lx) is ts)
+        # different options, different stream
+        ts2 = cache.get_tokens("def f(): pass", lexers.PythonLexer(opt="1"))
+        self.assert_(ts2 is not ts)
+        self.assertEquals(len(cache), 2)
+        # evict the least recently used streams
+        for i in range(30):
+            cache.get_tokens("x = %d" % i, lx)
+        self.assert_(cache.size <= cache.maxsize)
+        self.assert_(cache.get_tokens("def f(): pass", lx) is not ts)
+        # many hits and evictions don't let the queue grow
+        for i in range(300):
+            cache.get_tokens("x = %d" % (i % 40), lx)
+        self.assert_(len(cache._queue) < 100)
+
+    def test_key_version(self):
+        from pygments import cache
+        lx = lexers.PythonLexer()
+        key = cache.get_cache_key("x", lx)
+        cache.__version__ = 'next'
+        try:
+            self.assertNotEquals(cache.get_cache_key("x", lx), key)
+        finally:
+            cache.__version__ = pygments.__version__
+
+    def test_disk(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            code = u"s = u'\\xe4\\n' + \"'\"\n"
+            lx = lexers.PythonLexer()
+            ts = TokenCache(cachedir=tmpdir).get_tokens(code, lx)
+            self.assertEquals(len(os.listdir(tmpdir)), 1)
+            # a new cache has an empty memory tier
+            ts2 = TokenCache(cachedir=tmpdir).get_tokens(code, lx)
+            self.assertEquals(''.join([v for t, v in ts2]),
+                              ''.join([v for t, v in ts]))
+            self.assertEquals(pygments.highlight(code, lx, formatters.
+                                                 HtmlFormatter()),
+                              pygments.highlight(code, lx, formatters.
+                                                 HtmlFormatter(), cache=
+                                                 TokenCache(cachedir=tmpdir)))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TokenBufferTest(unittest.TestCase):
+
+    def test_buffer(self):
+        code = u"s = u'\\xe4\\n'\n" * 2000
+        lx = lexers.PythonLexer()
+        tokens = list(lx.get_tokens(code))
+        buf = TokenBuffer(lx.get_tokens(code))
+        self.assertEquals(len(buf), len(tokens))
+        self.assertEquals(list(buf), tokens)
+        self.assertEquals(buf[1], tokens[1])
+        self.assertEquals(buf[-1], tokens[-1])
+        self.assertEquals(buf.text, code)
+        self.assertEquals(list(buf.get_tokens_unprocessed()),
+                          list(lx.get_tokens_unprocessed(code)))
+        # the types are stored once per buffer
+        self.assertEquals(len(buf.ttypes), len(dict(tokens)))
+        self.assertEquals(pygments.format(buf, formatters.HtmlFormatter()),
+                          pygments.highlight(code, lx,
+                                             formatters.HtmlFormatter()))
+        self.assertEquals(list(TokenBuffer()), [])
+
+
+class BinaryTokenTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        code = u"s = u'\\xe4\\n' + '\xe4\\t'\n" * 100
+        lx = lexers.PythonLexer()
+        for tokens in (list(lx.get_tokens(code)),
+                       list(lx.get_tokens(code.encode('utf-8')))):
+            for compress in ('', 'zlib', 'bz2'):
+                fmt = formatters.BinaryTokenFormatter(compress=compress,
+                                                      blocksize=50)
+                data = pygments.format(tokens, fmt)
+                self.assertEquals(list(lexers.BinaryTokenLexer().
+                                       get_tokens(data)), tokens)
+                stream = lexers.BinaryTokenLexer().get_tokens_stream(
+                    StringIO.StringIO(data), 10)
+                self.assertEquals(list(stream), tokens)
+        # byte strings and unicode strings that can't be joined
+        tokens = [(Token.Text, '\xe9'), (Token.Text, u'\xe4'),
+                  (Token.Name, 'a')]
+        data = pygments.format(tokens, formatters.BinaryTokenFormatter())
+        self.assertEquals(list(lexers.BinaryTokenLexer().get_tokens(data)),
+                          tokens)
+        # not preprocessed like text
+        data = pygments.format([(Token.Text, '\n\r\n\t')],
+                               formatters.BinaryTokenFormatter())
+        self.assertEquals(list(lexers.BinaryTokenLexer().get_tokens(data)),
+                          [(Token.Text, '\n\r\n\t')])
+
+    def test_invalid_data(self):
+        lx = lexers.BinaryTokenLexer()
+        data = pygments.format([(Token.Name, 'x')],
+                               formatters.BinaryTokenFormatter())
+        # invalid data is returned as an error token
+        for invalid in ('x = 1\n', data[:7] + 'x' + data[8:]):
+            self.assertEquals(list(lx.get_tokens(invalid)),
+                              [(Token.Error, invalid)])
+        self.assertEquals(list(lx.get_tokens(data[:-1])),
+                          [(Token.Error, data[:-1])])
+        data = pygments.format([(Token.Name, 'x')] * 3,
+                               formatters.BinaryTokenFormatter(blocksize=1))
+        self.assertEquals(list(lx.get_tokens(data[:-1])),
+                          [(Token.Name, 'x')] * 2 +
+                          [(Token.Error, data[-22:-1])])
+
+
+class PluginTest(unittest.TestCase):
+
+    class FakeEntryPoint(object):
+        name = 'fakelexer'
+        def load(self):
+            return lexers.TextLexer
+
+    def setUp(self):
+        self.calls = 0
+        self.orig_pkg_resources = plugin.pkg_resources
+        outer = self
+        class FakePkgResources(object):
+            def iter_entry_points(self, group):
+                outer.calls += 1
+                if group == plugin.LEXER_ENTRY_POINT:
+                    return [outer.FakeEntryPoint()]
+                return []
+        plugin.pkg_resources = FakePkgResources()
+        plugin.clear_plugin_cache()
+
+    def tearDown(self):
+        plugin.pkg_resources = self.orig_pkg_resources
+        plugin.clear_plugin_cache()
+
+    def test_builtins_need_no_discovery(self):
+        lexers.get_lexer_by_name('python')
+        lexers.get_lexer_for_filename('a.py')
+        formatters.get_formatter_by_name('html')
+        self.assertEquals(self.calls, 0)
+        # plugins are looked for if no builtin matches
+        self.assertRaises(ValueError, lexers.get_lexer_by_name, 'nolexer')
+        self.assertEquals(self.calls, 1)
+
+    def test_indexes_are_replaced(self):
+        # lookups in other threads must never see partly built indexes
+        builtin = lexers._init_indexes()
+        self.assertRaises(ValueError, lexers.get_lexer_by_name, 'nolexer')
+        indexes = lexers._init_indexes()
+        self.assert_(indexes is not builtin)
+        self.assertEquals((builtin[4], indexes[4]), (False, True))
+        self.assertEquals(indexes[0]['python'], builtin[0]['python'])
+
+    def test_discovery_is_cached(self):
+        self.assertEquals(list(plugin.find_plugin_lexers()),
+                          [lexers.TextLexer])
+        for i in range(3):
+            self.assertRaises(ValueError, lexers.get_lexer_by_name, 'nolexer')
+        self.assertEquals(self.calls, 1)
+        plugin.clear_plugin_cache()
+        list(plugin.find_plugin_lexers())
+        self.assertEquals(self.calls, 2)
+
+
+class CmdlineTest(unittest.TestCase):
+
+    def test_export_styles(self):
+        from pygments.styles import STYLE_MAP
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.assertEquals(pygments.cmdline_main(
+                ['', '-S', 'all', '-d', tmpdir, '-a', '.hl']), 0)
+            f = file(os.path.join(tmpdir, 'index.txt'))
+            index = [line.split('\t') for line in f.read().splitlines()]
+            f.close()
+            self.assertEquals(len(index), 2 * len(STYLE_MAP))
+            self.assertEquals(len(os.listdir(tmpdir)), len(index) + 1)
+            for stylename, fmtername, fn in index:
+                f = file(os.path.join(tmpdir, fn))
+                fmter = formatters.get_formatter_by_name(fmtername,
+                                                         style=stylename)
+                self.assertEquals(f.read(), fmter.get_style_defs('.hl'))
+                f.close()
+            # the same content gets the same name
+            names = dict([((s, f), fn) for s, f, fn in index])
+            self.assertEquals(names['default', 'html'],
+                              names['emacs', 'html'].replace('emacs',
+                                                             'default'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_export_styles_index(self):
+        from pygments.styles import STYLE_MAP
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # formatters without style definitions are rejected
+            self.assertEquals(pygments.cmdline_main(
+                ['', '-S', 'all', '-d', tmpdir, '-f', 'terminal']), 1)
+            self.assertEquals(os.listdir(tmpdir), [])
+            # the index keeps the files of earlier runs
+            for fmtername in 'html', 'latex', 'html':
+                self.assertEquals(pygments.cmdline_main(
+                    ['', '-S', 'all', '-d', tmpdir, '-f', fmtername]), 0)
+            f = file(os.path.join(tmpdir, 'index.txt'))
+            index = f.read().splitlines()
+            f.close()
+            self.assertEquals(len(index), 2 * len(STYLE_MAP))
+            self.assertEquals(len(os.listdir(tmpdir)), len(index) + 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_bintokens(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            infn = os.path.join(tmpdir, 'a.py')
+            f = file(infn, 'w')
+            f.write('def f():\n\treturn 1\n')
+            f.close()
+            tokfn = os.path.join(tmpdir, 'a.btok')
+            outfn = os.path.join(tmpdir, 'a.html')
+            self.assertEquals(pygments.cmdline_main(
+                ['', '-f', 'bintokens', '-O', 'compress=zlib', '-o', tokfn,
+                 infn]), 0)
+            self.assertEquals(pygments.cmdline_main(
+                ['', '-l', 'bintokens', '-o', outfn, tokfn]), 0)
+            f = file(outfn)
+            self.assertEquals(f.read(), pygments.highlight(
+                'def f():\n\treturn 1\n', lexers.PythonLexer(),
+                formatters.HtmlFormatter()))
+            f.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_profile(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            infn = os.path.join(tmpdir, 'a.py')
+            f = file(infn, 'w')
+            f.write('def f():\n\treturn 1\n')
+            f.close()
+            outfn = os.path.join(tmpdir, 'a.txt')
+            self.assertEquals(pygments.cmdline_main(
+                ['', '-p', '-o', outfn, infn]), 0)
+            f = file(outfn)
+            self.assert_(f.read().startswith('Rule profile of PythonLexer'))
+            f.close()
+            self.assertEquals(pygments.cmdline_main(
+                ['', '-p', '-l', 'bintokens', infn]), 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_batch(self):
+        tmpdir = tempfile.mkdtemp()
+        orig_stderr = sys.stderr
+        try:
+            os.makedirs(os.path.join(tmpdir, 'src', 'sub'))
+            files = {'a.py': 'x = 1\n', 'sub/b.c': 'int x;\n', 'c.xyz': '?\n'}
+            for fn, code in files.iteritems():
+                f = file(os.path.join(tmpdir, 'src', fn), 'w')
+                f.write(code)
+                f.close()
+            outdir = os.path.join(tmpdir, 'out')
+            sys.stderr = StringIO.StringIO()
+            ret = pygments.cmdline_main(['', '-d', outdir, '-j', '2',
+                                         os.path.join(tmpdir, 'src'),
+                                         os.path.join(tmpdir, 'nofile.py')])
+            # the missing file is reported, the others are highlighted
+            self.assertEquals(ret, 1)
+            self.assert_('nofile.py' in sys.stderr.getvalue())
+            fmter = formatters.HtmlFormatter()
+            for fn in ('a.py', 'sub/b.c'):
+                f = file(os.path.join(outdir, fn + '.html'))
+                self.assertEquals(f.read(), pygments.highlight(files[fn],
+                    lexers.get_lexer_for_filename(fn), fmter))
+                f.close()
+            self.assertEquals(sorted(os.listdir(outdir)),
+                              ['a.py.html', 'style.css', 'sub'])
+        finally:
+            sys.stderr = orig_stderr
+            shutil.rmtree(tmpdir)
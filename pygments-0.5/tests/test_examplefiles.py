@@ -38,12 +38,16 @@ for fn in os.listdir(os.path.join(testdir, 'examplefiles')):
     def test(self, lx=lx, absfn=absfn):
         text = file(absfn, 'U').read()
         text = text.strip('\n') + '\n'
-        ntext = ''
+        ntext = []
         for type, val in lx.get_tokens(text):
-            ntext += val
+            ntext.append(val)
             self.failIf(type == Error, 'lexer generated error token for '+absfn)
-        if ntext != text:
+        if ''.join(ntext) != text:
             self.fail('round trip failed for '+absfn)
+        # the indices must be the positions of the tokens in the text
+        for index, type, val in lx.get_tokens_unprocessed(text):
+            if text[index:index+len(val)] != val:
+                self.fail('wrong index %d for %r in %s' % (index, val, absfn))
 
     setattr(ExampleFileTest, 'test_%i' % lfd, test)
     lfd += 1
@@ -1,6 +1,8 @@
 import unittest
 
 import pygments.lexers
+from pygments.lexer import do_insertions
+from pygments.token import Text, Generic
 
 class LexerTest(unittest.TestCase):
 
@@ -8,3 +10,36 @@ class LexerTest(unittest.TestCase):
         # instantiate every lexer, to see if the token type defs are correct
         for x in pygments.lexers.LEXERS.keys():
             c = getattr(pygments.lexers, x)()
+
+    def testBuiltinNamesShared(self):
+        php1 = pygments.lexers.PhpLexer()
+        php2 = pygments.lexers.PhpLexer(disabledmodules=['unknown'])
+        self.assert_(php1._functions is php2._functions)
+        self.assert_('mysql_connect' in php1._functions)
+        php3 = pygments.lexers.PhpLexer(disabledmodules=['MySQL'])
+        self.assert_('mysql_connect' not in php3._functions)
+        self.assertEquals(pygments.lexers.PhpLexer(
+            funcnamehighlighting=False)._functions, ())
+        lua = pygments.lexers.LuaLexer()
+        self.assert_(lua._functions is pygments.lexers.LuaLexer()._functions)
+
+    def testConsoleOffsets(self):
+        sessions = [
+            (pygments.lexers.PythonConsoleLexer(),
+             'Text\n>>> a = 1\n>>> for i in x:\n...     print i\n1\n'
+             'Traceback (most recent call last):\n  x\nError\n>>> \n'),
+            (pygments.lexers.RubyConsoleLexer(),
+             'irb(main):001:0> a = 1\n=> 1\nirb(main):002:0> def f\n'
+             'irb(main):003:1*   puts a\nirb(main):004:1> end\n=> nil\n'),
+        ]
+        for lexer, text in sessions:
+            tokens = list(lexer.get_tokens_unprocessed(text))
+            self.assertEquals(''.join([v for i, t, v in tokens]), text)
+            for index, ttype, value in tokens:
+                self.assertEquals(text[index:index+len(value)], value)
+
+    def testInsertionsAtEnd(self):
+        insertions = [(0, [(0, Generic.Prompt, '>')]),
+                      (0, [(0, Generic.Prompt, '$')])]
+        self.assertEquals(list(do_insertions(insertions, [], 3)),
+                          [(3, Generic.Prompt, '>'), (4, Generic.Prompt, '$')])
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+    Pygments regex lexer tests
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2006 by Georg Brandl.
+    :license: GNU GPL, see LICENSE for more details.
+"""
+
+import unittest
+import os
+import random
+
+from pygments.token import Text, Name, Keyword, String, Other
+from pygments.lexer import RegexLexer, DelegatingLexer, IncrementalLexer, \
+     bygroups, using
+from pygments.lexers import PythonLexer, RubyLexer, JavaLexer
+from pygments.profiling import profile_lexer, enable_profiling, \
+     disable_profiling
+
+
+class TestLexer(RegexLexer):
+    tokens = {
+        'root': [
+            (r'(if)(\s+)', bygroups(Keyword, Text)),
+            (r'[a-z]+', Name),
+            (r'(["\']).*?\1', String),
+            (r'i[a-z]*', Keyword),
+            (r'\s+', Text),
+        ],
+    }
+
+
+class RegexLexerTest(unittest.TestCase):
+
+    def test_merged_states(self):
+        # the unmergeable backreference rule splits the state in two
+        rules = TestLexer()._tokens['root']
+        self.assertEquals(len(rules), 3)
+        self.assertEquals(rules[0][1], None)
+        self.assertEquals(rules[1][2], None)
+
+    def test_first_match_wins(self):
+        tokens = list(TestLexer().get_tokens('if iffy "x"'))
+        self.assertEquals(tokens, [(Keyword, 'if'), (Text, ' '),
+                                   (Name, 'iffy'), (Text, ' '),
+                                   (String, '"x"'), (Text, '\n')])
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def test_profile(self):
+        tokens = TestLexer()._tokens
+        profile = profile_lexer(TestLexer(), 'if iffy "x" ?')
+        # the merged rules are counted one by one
+        self.assertEquals(profile.rules['root', 0][:2], [8, 1])
+        self.assertEquals(profile.rules['root', 4][:2], [5, 3])
+        self.assertEquals(profile.patterns['root', 4], r'\s+')
+        self.assertEquals(profile.fallbacks['root'], [1, 0])
+        self.assertEquals(profile.get_unproductive_rules(1), [('root', 0)])
+        self.assert_('Rule profile of TestLexer' in profile.format_report())
+        # the rule table is restored afterwards
+        self.assert_(TestLexer._tokens is tokens)
+
+    def test_inherited_tokens(self):
+        # the rule table of TestLexer exists, SubLexer inherits it
+        tokens = TestLexer()._tokens
+        class SubLexer(TestLexer):
+            pass
+        self.assert_('_tokens' not in SubLexer.__dict__)
+        profile = enable_profiling(SubLexer)
+        self.assert_(enable_profiling(SubLexer) is profile)
+        self.assert_(SubLexer()._tokens is not tokens)
+        self.assert_(TestLexer()._tokens is tokens)
+        self.assert_(disable_profiling(SubLexer) is profile)
+        # the class is as it was before
+        self.assert_('_tokens' not in SubLexer.__dict__)
+        self.assert_('_profile' not in SubLexer.__dict__)
+        self.assert_(SubLexer()._tokens is tokens)
+        self.assertEquals(disable_profiling(SubLexer), None)
+
+
+class UsingTest(unittest.TestCase):
+
+    def test_sublexers_are_cached(self):
+        created = []
+        class SubLexer(RegexLexer):
+            tokens = {'root': [(r'.+', Name)]}
+            def __init__(self, **options):
+                created.append(options)
+                RegexLexer.__init__(self, **options)
+        class OuterLexer(RegexLexer):
+            tokens = {'root': [(r'<.*?>', using(SubLexer, sub='1')),
+                               (r'\s+', Text)]}
+        lexer = OuterLexer(outer='1')
+        tokens = list(lexer.get_tokens('<a> <b>'))
+        self.assertEquals(tokens[:3], [(Name, '<a>'), (Text, ' '),
+                                       (Name, '<b>')])
+        # one sub-lexer per outer lexer, which gets the outer options
+        self.assertEquals(created, [{'sub': '1', 'outer': '1'}])
+        list(OuterLexer().get_tokens('<c>'))
+        self.assertEquals(created[1], {'sub': '1'})
+
+
+class TemplateLexer(RegexLexer):
+    tokens = {
+        'root': [
+            (r'\{\w*\}', Keyword),
+            (r'[^{]+', Other),
+        ],
+    }
+
+
+class DelegatingLexerTest(unittest.TestCase):
+
+    def make_lexer(self, chunksize, progress):
+        class LanguageLexer(TemplateLexer):
+            def get_tokens_unprocessed(self, text):
+                for i, t, v in TemplateLexer.get_tokens_unprocessed(self,
+                                                                    text):
+                    progress.append(i)
+                    yield i, t, v
+        class Lexer(DelegatingLexer):
+            def __init__(self, **options):
+                DelegatingLexer.__init__(self, TestLexer, LanguageLexer,
+                                         **options)
+        Lexer.chunksize = chunksize
+        return Lexer()
+
+    def test_single_pass(self):
+        text = 'a {b} if c\n' * 1000
+        progress = []
+        tokens = self.make_lexer(100, progress).get_tokens_unprocessed(text)
+        first = tokens.next()
+        # the root lexer started before the language lexer was through
+        self.assert_(progress[-1] < len(text) / 2)
+        tokens = [first] + list(tokens)
+        wanted = list(self.make_lexer(len(text), []).
+                      get_tokens_unprocessed(text))
+        self.assertEquals(tokens, wanted)
+        self.assertEquals(tokens[:5], [(0, Name, 'a'), (1, Text, ' '),
+                                       (2, Keyword, '{b}'), (5, Text, ' '),
+                                       (6, Keyword, 'if')])
+        offset = 0
+        for i, t, v in tokens:
+            self.assertEquals(i, offset)
+            offset += len(v)
+        self.assertEquals(offset, len(text))
+
+
+    def test_no_line_boundaries(self):
+        lexed = []
+        class RootLexer(TestLexer):
+            def get_tokens_unprocessed(self, text, **kwds):
+                lexed.append(len(text))
+                return TestLexer.get_tokens_unprocessed(self, text, **kwds)
+        class Lexer(DelegatingLexer):
+            chunksize = 100
+            def __init__(self, **options):
+                DelegatingLexer.__init__(self, RootLexer, TemplateLexer,
+                                         **options)
+        text = 'a {b} ' * 5000
+        tokens = list(Lexer().get_tokens_unprocessed(text))
+        self.assertEquals(''.join([v for i, t, v in tokens]), text)
+        # the parts without a place to resume from aren't lexed again
+        # for every new piece
+        self.assert_(sum(lexed) < 5 * len(text))
+
+
+class IncrementalLexerTest(unittest.TestCase):
+
+    def check_edits(self, lexer, fn, edits):
+        text = file(os.path.join(testdir, 'examplefiles', fn)).read()
+        inc = IncrementalLexer(lexer, text)
+        for needle, newtext in edits:
+            start = inc.text.index(needle)
+            index, removed, added = inc.update(start, start + len(needle),
+                                               newtext)
+            wanted = [(t, v) for i, t, v in
+                      lexer.get_tokens_unprocessed(inc.text)]
+            self.assertEquals(inc.tokens, wanted)
+            # the stream must have converged again long before the end
+            self.assert_(added < len(wanted) / 2)
+            offset = 0
+            offsets = []
+            for t, v in inc.tokens:
+                offsets.append(offset)
+                offset += len(v)
+            offsets.append(offset)
+            for offset, stack, idx in inc.checkpoints:
+                self.assertEquals(offsets[idx], offset)
+
+    def test_regexlexer(self):
+        # the second edit opens a string, the third closes it again
+        self.check_edits(PythonLexer(), 'test.boo', [
+            ('import', 'from x import'),
+            ('print', 'print """'),
+            ('def ', '""" def '),
+        ])
+
+    def test_random_edits(self):
+        # the edits don't add quotes or comment ends, which could end a
+        # string or comment that was left open further up (see the
+        # IncrementalLexer docstring), but they change method signatures
+        # whose tokens depend on text several lines below
+        text = file(os.path.join(testdir, 'examplefiles',
+                                 'test.java')).read()
+        lexer = JavaLexer()
+        inc = IncrementalLexer(lexer, text)
+        rnd = random.Random(11)
+        for n in xrange(150):
+            start = rnd.randrange(len(inc.text) + 1)
+            end = min(start + rnd.randrange(3), len(inc.text))
+            newtext = ''.join([rnd.choice('ab *(){}\n')
+                               for j in xrange(rnd.randrange(3))])
+            inc.update(start, end, newtext)
+            self.assertEquals(inc.tokens,
+                              [(t, v) for i, t, v in
+                               lexer.get_tokens_unprocessed(inc.text)])
+
+    def test_extendedregexlexer(self):
+        self.check_edits(RubyLexer(), 'test.rb', [
+            ('class', 'module'),
+            ('end', 'end # <<EOF'),
+            ('def', '%w[a b]; def'),
+        ])